@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import bz2
+import gzip
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from fnmatch import fnmatch
+from dataclasses import dataclass, asdict, replace
+from typing import List, Tuple, Dict, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mtSVG
+
+
+# ----------------------------- GENERATOR -----------------------------#
+
+# name, typical length, feature and product of the 37 genes of a metazoan mitogenome
+PROTEIN_GENES = [('cox1', 1540), ('cox2', 690), ('cox3', 780), ('cob', 1140), ('nad1', 950), ('nad2', 1040),
+                 ('nad3', 350), ('nad4', 1380), ('nad4L', 300), ('nad5', 1810), ('nad6', 520), ('atp6', 680),
+                 ('atp8', 160)]
+RRNA_GENES = [('rrnL', 1560, '16S ribosomal RNA'), ('rrnS', 950, '12S ribosomal RNA')]
+# the same products worded to be written on two lines, the first one naming no gene
+RRNA_MULTILINE_PRODUCTS = {'16S ribosomal RNA': ('ribosomal RNA', 'large subunit'),
+                           '12S ribosomal RNA': ('ribosomal RNA', 'small subunit')}
+TRNA_GENES = [('A', 'Ala', 'tgc'), ('R', 'Arg', 'tcg'), ('N', 'Asn', 'gtt'), ('D', 'Asp', 'gtc'), ('C', 'Cys', 'gca'),
+              ('Q', 'Gln', 'ttg'), ('E', 'Glu', 'ttc'), ('G', 'Gly', 'tcc'), ('H', 'His', 'gtg'), ('I', 'Ile', 'gat'),
+              ('L1', 'Leu', 'tag'), ('L2', 'Leu', 'taa'), ('K', 'Lys', 'ttt'), ('M', 'Met', 'cat'),
+              ('F', 'Phe', 'gaa'), ('P', 'Pro', 'tgg'), ('S1', 'Ser', 'tct'), ('S2', 'Ser', 'tga'),
+              ('T', 'Thr', 'tgt'), ('W', 'Trp', 'tca'), ('Y', 'Tyr', 'gta'), ('V', 'Val', 'tac')]
+TRNA_LENGTH = 68
+MINUS_STRAND_RATIO = 0.3
+MAX_GAP = 60
+
+
+@dataclass
+class SyntheticGene:
+    name: str
+    feature: str
+    product: str
+    start: int
+    end: int
+    orientation: str
+
+
+def get_gene_set() -> List[Tuple[str, int, str, str]]:
+    genes = [(name, length, 'gene', None) for name, length in PROTEIN_GENES]
+    genes += [(name, length, 'rRNA', product) for name, length, product in RRNA_GENES]
+    genes += [(f'trn{code}({anticodon})', TRNA_LENGTH, 'tRNA', f'tRNA-{amino_acid}')
+              for code, amino_acid, anticodon in TRNA_GENES]
+    return genes
+
+
+def generate_genes(rng: random.Random, nb_genes: int) -> Tuple[List[SyntheticGene], int]:
+    # the gene set repeated up to nb_genes, shuffled after cox1, separated by random gaps
+    gene_set, genes, position = get_gene_set(), [], 1
+    names = [gene_set[0]] + rng.sample(gene_set[1:], len(gene_set) - 1)
+    for i in range(nb_genes):
+        name, length, feature, product = names[i % len(names)]
+        if i >= len(names):
+            name = f'{name}_{i // len(names)}'
+        length = max(30, int(length * rng.uniform(0.9, 1.1)))
+        orientation = '-' if rng.random() < MINUS_STRAND_RATIO else '+'
+        genes.append(SyntheticGene(name, feature, product, position, position + length - 1, orientation))
+        position += length + rng.randint(0, MAX_GAP)
+    return genes, position - 1
+
+
+def write_mitos_gff(f, seqid: str, genes: List[SyntheticGene]):
+    # one line per gene holding its name, as written by MITOS
+    for gene in genes:
+        source, feature = ('mitfi', 'tRNA') if gene.feature == 'tRNA' else ('mitos', gene.feature)
+        f.write(f'{seqid}\t{source}\t{feature}\t{gene.start}\t{gene.end}\t1.0\t{gene.orientation}\t.\t'
+                f'Name={gene.name}\n')
+
+
+def write_genbank_gff(f, seqid: str, species: str, length: int, genes: List[SyntheticGene]):
+    # protein genes named by gene=, RNA genes named by the product= of the next line, as converted from GenBank
+    f.write(f'##gff-version 3\n##sequence-region {seqid} 1 {length}\n')
+    f.write(f'{seqid}\tRefSeq\tregion\t1\t{length}\t.\t+\t.\tID={seqid}:1..{length};'
+            f'organism={species.replace(" ", "%20")}\n')
+    for i, gene in enumerate(genes):
+        if gene.product is None:
+            f.write(f'{seqid}\tRefSeq\tgene\t{gene.start}\t{gene.end}\t.\t{gene.orientation}\t.\t'
+                    f'ID=gene-{i};gene={gene.name.split("_")[0].upper()}\n')
+        else:
+            f.write(f'{seqid}\tRefSeq\tgene\t{gene.start}\t{gene.end}\t.\t{gene.orientation}\t.\tID=gene-{i}\n')
+            f.write(f'{seqid}\tRefSeq\t{gene.feature}\t{gene.start}\t{gene.end}\t.\t{gene.orientation}\t.\t'
+                    f'ID=rna-{i};Parent=gene-{i};product={gene.product}\n')
+
+
+def get_flatfile_location(gene: SyntheticGene, length: int, split: bool = False) -> List[str]:
+    # the lines of the location of a gene, joined around the origin when its end is before its start,
+    # or split in two parts of one line each
+    if gene.start > gene.end:
+        parts = [f'{gene.start}..{length},', f'1..{gene.end}']
+    elif split:
+        middle = (gene.start + gene.end) // 2
+        parts = [f'{gene.start}..{middle},', f'{middle + 1}..{gene.end}']
+    else:
+        parts = [f'{gene.start}..{gene.end}']
+    if len(parts) > 1:
+        parts[0], parts[-1] = f'join({parts[0]}', f'{parts[-1]})'
+    if gene.orientation == '-':
+        parts[0] = f'complement({parts[0]}'
+        parts[-1] = f'{parts[-1]})'
+    return parts
+
+
+def write_genbank_flatfile(f, seqid: str, species: str, length: int, genes: List[SyntheticGene],
+                           multiline: bool = False):
+    # a gene feature per gene, named by the product of the next tRNA or rRNA feature for RNA genes, then the sequence,
+    # multiline splits the locations of the protein genes and the products of the rRNA genes over two lines,
+    # and names the tRNA genes by their gene feature too
+    f.write(f'LOCUS       {seqid:<16}{length:>11} bp    DNA     circular INV 01-JAN-2000\n'
+            f'DEFINITION  {species} mitochondrion, complete genome.\n'
+            f'SOURCE      mitochondrion {species}\n  ORGANISM  {species}\n            Eukaryota; Metazoa.\n'
+            f'FEATURES             Location/Qualifiers\n     source          1..{length}\n')
+    for gene in genes:
+        location = get_flatfile_location(gene, length, multiline and gene.product is None)
+        f.write(f'     gene            {location[0]}\n' + ''.join(f'{"":<21}{part}\n' for part in location[1:]))
+        if gene.product is None:
+            f.write(f'                     /gene="{gene.name.split("_")[0].upper()}"\n')
+            if multiline:
+                f.write('                     /note="a qualifier on two lines,\n'
+                        '                     ignored"\n')
+        else:
+            if multiline and gene.feature == 'tRNA':
+                f.write(f'                     /gene="{gene.name.split("_")[0].split("(")[0]}"\n')
+            f.write(f'     {gene.feature:<16}{location[0]}\n' + ''.join(f'{"":<21}{part}\n' for part in location[1:]))
+            if multiline and gene.product in RRNA_MULTILINE_PRODUCTS:
+                first, rest = RRNA_MULTILINE_PRODUCTS[gene.product]
+                f.write(f'                     /product="{first}\n                     {rest}"\n')
+            else:
+                f.write(f'                     /product="{gene.product}"\n')
+    f.write('ORIGIN\n')
+    for i in range(0, length, 60):
+        f.write(f'{i + 1:>9} ' + ' '.join(['acgtacgtac'] * min(6, (length - i + 9) // 10)) + '\n')
+    f.write('//\n')
+
+
+def generate_dataset(directory: str, style: str, nb_genomes: int, nb_genes: int,
+                     seed: int = 1) -> List[Tuple[str, int, str, bool]]:
+    # one gff per genome and the matching --gffs entries
+    rng, entries = random.Random(seed), []
+    for i in range(nb_genomes):
+        species, seqid = f'Synthetic species {i}', f'NC_{i:06d}.1'
+        genes, length = generate_genes(rng, nb_genes)
+        path = os.path.join(directory, f'{style}_{i}.gb' if style == 'flatfile' else f'{style}_{i}.gff')
+        with open(path, 'wt') as f:
+            if style == 'mitos':
+                write_mitos_gff(f, seqid, genes)
+            elif style == 'flatfile':
+                write_genbank_flatfile(f, seqid, species, length, genes)
+            else:
+                write_genbank_gff(f, seqid, species, length, genes)
+        entries.append((species, length, path, False))
+    return entries
+
+
+# ----------------------------- PARSER CHECK -----------------------------#
+
+def wrap_origin(genes: List[SyntheticGene], length: int) -> List[SyntheticGene]:
+    # the genes rotated so that the first one wraps around the origin, its end before its start
+    middle = (genes[0].start + genes[0].end) // 2
+    return [replace(gene, start=(gene.start - middle - 1) % length + 1, end=(gene.end - middle - 1) % length + 1)
+            for gene in genes]
+
+
+def get_gene_key(name: str) -> str:
+    # MITOS numbers the leucine and serine tRNAs, GenBank products do not
+    name = mtSVG.get_clean_name(name).lower()
+    return name[:4] if name.startswith('trn') else name
+
+
+def check_parsers(directory: str, nb_genes: int = 37, seed: int = 1) -> List[str]:
+    # two genomes, one wrapping around the origin, written in one file per style, plain and compressed,
+    # each file must be read as the genes written
+    rng, records = random.Random(seed), []
+    for i in range(2):
+        genes, length = generate_genes(rng, nb_genes)
+        records.append((f'Synthetic species {i}', f'NC_{i:06d}.1', length, wrap_origin(genes, length) if i else genes))
+    paths = []
+    for style in STYLES:
+        path = os.path.join(directory, f'check_{style}.gb' if style == 'flatfile' else f'check_{style}.gff')
+        with open(path, 'wt') as f:
+            for species, seqid, length, genes in records:
+                if style == 'mitos':
+                    write_mitos_gff(f, seqid, genes)
+                elif style == 'flatfile':
+                    write_genbank_flatfile(f, seqid, species, length, genes, multiline=True)
+                else:
+                    write_genbank_gff(f, seqid, species, length, genes)
+        with open(path, 'rb') as f:
+            data = f.read()
+        for extension, compress in (('.gz', gzip.compress), ('.bz2', bz2.compress)):
+            with open(path + extension, 'wb') as f:
+                f.write(compress(data))
+        paths += [(style, path), (style, path + '.gz'), (style, path + '.bz2')]
+
+    failures = []
+    for style, path in paths:
+        genomes = list(mtSVG.read_gff(path))
+        if len(genomes) != len(records):
+            failures.append(f'{os.path.basename(path)}: {len(genomes)} records read instead of {len(records)}')
+            continue
+        for genome, (species, seqid, length, genes) in zip(genomes, records):
+            expected = [(get_gene_key(gene.name), gene.orientation, gene.start, gene.end)
+                        for gene in sorted(genes, key=lambda x: x.start)]
+            read = [(get_gene_key(gene.name), gene.orientation, gene.start, gene.end) for gene in genome.genes]
+            if read != expected:
+                first = next(i for i in range(max(len(read), len(expected))) if read[i:i + 1] != expected[i:i + 1])
+                failures.append(f'{os.path.basename(path)}: {seqid} gene {first} read as {read[first:first + 1]} '
+                                f'instead of {expected[first:first + 1]}')
+            # MITOS gffs hold neither the species nor the genome length
+            if style != 'mitos' and (genome.species, genome.length) != (species, length):
+                failures.append(f'{os.path.basename(path)}: {seqid} read as {genome.species} of {genome.length} bp '
+                                f'instead of {species} of {length} bp')
+    return failures
+
+
+# ----------------------------- BENCHMARK -----------------------------#
+
+STYLES = ('mitos', 'genbank', 'flatfile')
+
+
+@dataclass
+class Result:
+    name: str
+    style: str
+    genomes: int
+    genes: int
+    stage: str
+    seconds: float
+    peak_mb: float
+    output_bytes: int = None
+
+
+def measure(stage: Callable[[], None], repeat: int) -> Tuple[float, float]:
+    # best time of repeat runs, then the peak of the memory allocated by a last traced run
+    seconds = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        stage()
+        seconds = min(seconds, time.perf_counter() - start_time)
+    tracemalloc.start()
+    try:
+        stage()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak / 2 ** 20
+
+
+def get_stages(entries: List[Tuple[str, int, str, bool]], directory: str) -> Dict[str, Tuple[Callable, str]]:
+    # stage name -> function to time and output whose size is recorded
+    ribbons, circle = os.path.join(directory, 'ribbons.svg'), os.path.join(directory, 'circle.svg')
+    concentric = os.path.join(directory, 'concentric.svg')
+    arranged = mtSVG.get_genomes(entries, 'cox1', 0, False, None)
+    return {'parse_gff': (lambda: [mtSVG.parse_gff(entry[2], []) for entry in entries], None),
+            'get_genomes': (lambda: mtSVG.get_genomes(entries, 'cox1', 0, False, None), None),
+            'get_genomes_intergenic': (lambda: mtSVG.get_genomes(entries, 'cox1', 10, False, None), None),
+            'draw_ribbons': (lambda: mtSVG.draw_ribbons(arranged, ribbons, oriented=True), ribbons),
+            'draw_circle': (lambda: mtSVG.draw_circle(arranged[:1], circle, oriented=True), circle),
+            'draw_concentric': (lambda: mtSVG.draw_circle(arranged, concentric, oriented=True), concentric)}
+
+
+def run_benchmarks(styles: List[str], nb_genomes: List[int], nb_genes: List[int], repeat: int = 3, seed: int = 1,
+                   progress: bool = True) -> List[Result]:
+    results = []
+    for style in styles:
+        for genomes in nb_genomes:
+            for genes in nb_genes:
+                with tempfile.TemporaryDirectory() as directory:
+                    entries = generate_dataset(directory, style, genomes, genes, seed)
+                    for stage, (function, output) in get_stages(entries, directory).items():
+                        seconds, peak_mb = measure(function, repeat)
+                        output_bytes = None if output is None else os.path.getsize(output)
+                        result = Result(f'{style}/{genomes}x{genes}/{stage}', style, genomes, genes, stage,
+                                        seconds, peak_mb, output_bytes)
+                        if progress:
+                            print(f'{result.name:<45} {seconds * 1000:>10.1f} ms {peak_mb:>8.1f} MB', flush=True)
+                        results.append(result)
+    return results
+
+
+def check_thresholds(results: List[Result], thresholds: Dict[str, Dict[str, float]]) -> List[str]:
+    # thresholds map a result name, possibly a glob pattern, to the maximum seconds, peak_mb or output_bytes
+    failures = []
+    for result in results:
+        for pattern, limits in thresholds.items():
+            if not fnmatch(result.name, pattern):
+                continue
+            for key, limit in limits.items():
+                value = getattr(result, key)
+                if value is not None and value > limit:
+                    failures.append(f'{result.name}: {key} {value:.3f} > {limit} ({pattern})')
+    return failures
+
+
+# ----------------------------- MAIN -----------------------------#
+
+def parse_ints(values: str) -> List[int]:
+    return [int(value) for value in values.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the stages of mtSVG on synthetic mitogenomes')
+    parser.add_argument('--styles', type=str, default=','.join(STYLES),
+                        help='Comma separated styles to generate, mitos, genbank (converted gff) and/or flatfile')
+    parser.add_argument('--genomes', type=parse_ints, default=[1, 10, 100],
+                        help='Comma separated numbers of genomes (default: 1,10,100)')
+    parser.add_argument('--genes', type=parse_ints, default=[37, 150],
+                        help='Comma separated numbers of genes per genome (default: 37,150)')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of timed runs of each stage, the best is kept')
+    parser.add_argument('--seed', type=int, default=1, help='The seed of the generator')
+    parser.add_argument('--output', type=str, default='benchmark.json', help='The path of the json results')
+    parser.add_argument('--check', type=str,
+                        help='The path of a json file of thresholds, {"name pattern": {"seconds": max, "peak_mb": '
+                             'max, "output_bytes": max}}, the exit code is 1 if one is exceeded')
+    args = parser.parse_args()
+
+    styles = args.styles.split(',')
+    if any(style not in STYLES for style in styles):
+        sys.exit(f'Error : unknown style in {args.styles}')
+    with tempfile.TemporaryDirectory() as directory:
+        failures = check_parsers(directory, seed=args.seed)
+    if failures:
+        sys.exit('Error : the parsers disagree\n' + '\n'.join(failures))
+    results = run_benchmarks(styles, args.genomes, args.genes, args.repeat, args.seed)
+    with open(args.output, 'wt') as f:
+        json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                   'results': [asdict(result) for result in results]}, f, indent=1)
+
+    if args.check is not None:
+        with open(args.check, 'rt') as f:
+            failures = check_thresholds(results, json.load(f))
+        if failures:
+            sys.exit('Error : thresholds exceeded\n' + '\n'.join(failures))
+    print('Done !')
@@ -5,10 +5,40 @@ import re
 import argparse
 import sys
 import logging
+import os
+import glob
+import gzip
+import bz2
+import zlib
+import pickle
+import hashlib
+import json
+import time
+import threading
+import copy
+import cProfile
+import tracemalloc
+import socketserver
+import sqlite3
+import shlex
+import ipaddress
 import drawsvg as draw
+from drawsvg.drawing import SVG_END
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, chain, groupby, islice, repeat
+from collections import Counter, defaultdict, deque, OrderedDict
+from io import StringIO, TextIOWrapper, RawIOBase, BufferedIOBase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from operator import sub, truediv
+from stat import S_ISSOCK
 from math import ceil, pi, cos, sin
-from typing import List, Tuple
-from dataclasses import dataclass
+from typing import List, Tuple, Dict, Optional, Iterator, Iterable, Sequence, Callable, TextIO, BinaryIO, Union
+from urllib.parse import unquote
+from dataclasses import dataclass, fields, replace, asdict
+from functools import lru_cache, partial
+from contextlib import nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
 
 logging.basicConfig(
@@ -17,11 +47,175 @@ logging.basicConfig(
 )
 
 
+class MtSVGError(Exception):
+    pass
+
+
+# ----------------------------- PROFILING -----------------------------
+
+class ProfileStage:
+    # wall time and, when tracemalloc is tracing, allocations of one stage, counts are added by the caller
+
+    def __init__(self, profiler: 'Profiler', name: str, subject: str = None):
+        self.profiler = profiler
+        self.record = {'stage': name, 'subject': subject}
+
+    def add(self, **counts):
+        self.record.update(counts)
+
+    def __enter__(self) -> 'ProfileStage':
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.record['seconds'] = time.perf_counter() - self.start_time
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.record['allocated_mb'] = (current - self.memory) / 2 ** 20
+            self.record['peak_mb'] = (peak - self.memory) / 2 ** 20
+        self.profiler.records.append(self.record)
+
+
+class Profiler:
+    # records the stages run while it is started, stages are not expected to be nested
+
+    def __init__(self, trace_memory: bool = True, cprofile: bool = False):
+        self.trace_memory = trace_memory
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.records = []
+
+    def start(self):
+        global PROFILER
+        PROFILER, self.start_time = self, time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        global PROFILER
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.trace_memory:
+            tracemalloc.stop()
+        PROFILER, self.total_seconds = None, time.perf_counter() - self.start_time
+
+    def __enter__(self) -> 'Profiler':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get_report(self) -> dict:
+        # totals per stage followed by every record, in order
+        stages = {}
+        for record in self.records:
+            stage = stages.setdefault(record['stage'], {'calls': 0})
+            stage['calls'] += 1
+            for key, value in record.items():
+                if key == 'peak_mb':
+                    stage[key] = max(stage.get(key, 0), value)
+                elif key not in ('stage', 'subject'):
+                    stage[key] = stage.get(key, 0) + value
+        return {'total_seconds': getattr(self, 'total_seconds', None), 'stages': stages, 'records': self.records}
+
+    def save(self, filepath: str):
+        with open(filepath, 'wt', encoding='utf-8') as f:
+            json.dump(self.get_report(), f, indent=1)
+
+    def dump_stats(self, filepath: str):
+        if self.cprofile is None:
+            raise MtSVGError('cProfile was not enabled')
+        self.cprofile.dump_stats(filepath)
+
+
+# the started profiler, stages are not recorded while None
+PROFILER = None
+NO_STAGE = nullcontext()
+
+
+def profile_stage(name: str, subject: str = None) -> Union[ProfileStage, nullcontext]:
+    return NO_STAGE if PROFILER is None else ProfileStage(PROFILER, name, subject)
+
+
+# ----------------------------- GENE NAMES -----------------------------
+
+GENE_NAME_PREFIXES = set(['trn', 'rrn', 'atp', 'co', 'cy', 'na', 'nd'])
+# product substrings checked in order, rRNAs first
+PRODUCT_NAMES = (('16s', 'rrnL'), ('large', 'rrnL'), ('12s', 'rrnS'), ('small', 'rrnS'))
+TRNA_CODES = {'ala': 'A', 'arg': 'R', 'asn': 'N', 'asp': 'D', 'asx': 'B', 'cys': 'C', 'gln': 'Q', 'glu': 'E',
+              'glx': 'Z', 'gly': 'G', 'his': 'H', 'ile': 'I', 'leu': 'L', 'lys': 'K', 'met': 'M', 'phe': 'F',
+              'pro': 'P', 'ser': 'S', 'thr': 'T', 'trp': 'W', 'tyr': 'Y', 'val': 'V'}
+TRNA_PRODUCT = re.compile('trna-(' + '|'.join(TRNA_CODES) + ')')
+# user supplied synonyms, lower case synonym or product -> gene name
+GENE_SYNONYMS = {}
+
+
+def set_synonyms(synonyms: Dict[str, str]):
+    GENE_SYNONYMS.clear()
+    GENE_SYNONYMS.update({k.strip().lower(): v.strip() for k, v in synonyms.items()})
+    for f in (product_to_gene_name, check_gene_name, normalize_gene_name):
+        f.cache_clear()
+
+
+def load_synonyms(filepath: str):
+    # semicolon separated "synonym;gene name" lines, "#" starts a comment
+    synonyms = {}
+    with open(filepath, 'rt') as f:
+        for line in f:
+            lsplt = line.strip().split(';')
+            if line.startswith('#') or len(lsplt) < 2:
+                continue
+            synonyms[lsplt[0]] = lsplt[1]
+    set_synonyms(synonyms)
+
+
+@lru_cache(maxsize=4096)
+def normalize_gene_name(name: str) -> str:
+    return GENE_SYNONYMS.get(name.lower(), name)
+
+
+@lru_cache(maxsize=4096)
+def product_to_gene_name(product: str) -> str:
+    p = product.lower()
+    if p in GENE_SYNONYMS:
+        return GENE_SYNONYMS[p]
+    for substring, gene_name in PRODUCT_NAMES:
+        if substring in p:
+            return gene_name
+    match = TRNA_PRODUCT.search(p)
+    if match is None:
+        raise MtSVGError(f'Unknown product name: {p}')
+    return 'trn' + TRNA_CODES[match.group(1)]
+
+
+@lru_cache(maxsize=4096)
+def check_gene_name(name: str) -> bool:
+    return normalize_gene_name(name).lower().startswith(tuple(GENE_NAME_PREFIXES))
+
+
+@lru_cache(maxsize=4096)
+def get_clean_name(gene_name: str) -> str:
+    try:
+        lower_name = gene_name.lower()
+        if lower_name.startswith(('trn', 'rrn')):
+            return gene_name.split('_')[0].split('(')[0]
+        elif lower_name.startswith('nad4') and len(gene_name) > 4:
+            return 'nad4L'
+        else:
+            return gene_name.split('_')[0].split('-')[0].lower()
+    except AttributeError:
+        return gene_name
+
+
 # ----------------------------- GFF PARSING -----------------------------
 
 GENE_CLASSES_MITOS = set(['gene', 'trna', 'rrna'])
 GENE_CLASSES_GENEBANK = set(['gene'])
-GENE_NAME_PREFIXES = set(['trn', 'rrn', 'atp', 'co', 'cy', 'na', 'nd'])
 
 
 @dataclass
@@ -44,181 +238,881 @@ class MtGenome:
     species: str
     length: int
     genes: list
+    reversed: bool = False
 
     def get_scaled_length(self) -> int:
         return sum([g.scaled_length for g in self.genes])
 
+    def get_nb_genes(self) -> int:
+        return len(self.genes)
 
-def product_to_gene_name(product: str) -> str:
-    p = product.lower()
-    if '16s' in p or 'large' in p:
-        return 'rrnL'
-    elif '12s' in p or 'small' in p:
-        return 'rrnS'
-    elif 'trna-ala' in p:
-        return 'trnA'
-    elif 'trna-arg' in p:
-        return 'trnR'
-    elif 'trna-asn' in p:
-        return 'trnN'
-    elif 'trna-asp' in p:
-        return 'trnD'
-    elif 'trna-asx' in p:
-        return 'trnB'
-    elif 'trna-cys' in p:
-        return 'trnC'
-    elif 'trna-gln' in p:
-        return 'trnQ'
-    elif 'trna-glu' in p:
-        return 'trnE'
-    elif 'trna-glx' in p:
-        return 'trnZ'
-    elif 'trna-gly' in p:
-        return 'trnG'
-    elif 'trna-his' in p:
-        return 'trnH'
-    elif 'trna-ile' in p:
-        return 'trnI'
-    elif 'trna-leu' in p:
-        return 'trnL'
-    elif 'trna-lys' in p:
-        return 'trnK'
-    elif 'trna-met' in p:
-        return 'trnM'
-    elif 'trna-phe' in p:
-        return 'trnF'
-    elif 'trna-pro' in p:
-        return 'trnP'
-    elif 'trna-ser' in p:
-        return 'trnS'
-    elif 'trna-thr' in p:
-        return 'trnT'
-    elif 'trna-trp' in p:
-        return 'trnW'
-    elif 'trna-tyr' in p:
-        return 'trnY'
-    elif 'trna-val' in p:
-        return 'trnV'
-    else: 
-        raise Exception(f'Unknown product name: {p}')
+    def add_intergenic(self, intergenic: int):
+        regions = get_intergenic_regions([g.start for g in self.genes], [g.end for g in self.genes],
+                                         self.length, intergenic)
+        genes, previous = [], 0
+        for i, region_start, region_end in regions:
+            genes.extend(self.genes[previous:i])
+            genes.append(Gene('intergenic', None, region_start, region_end))
+            previous = i
+        genes.extend(self.genes[previous:])
+        self.genes = genes
 
+    def reverse(self):
+        self.genes.reverse()
+        for gene in self.genes:
+            gene.orientation = '+' if gene.orientation == '-' else '-'
 
-def check_gene_name(name: str) -> bool:
-    return any([name.lower().startswith(prefix) for prefix in GENE_NAME_PREFIXES])
+    def get_start_index(self, start: str, linear: bool) -> int:
+        return get_start_index([g.name for g in self.genes], start, linear, self.species)
 
+    def rotate(self, start_idx: int):
+        self.genes = self.genes[start_idx:] + self.genes[:start_idx]
 
-def get_gene_name(lines: List, idx: int) -> str:
-    lsplt = lines[idx].strip().split('\t')
-    # try 'Name=' at current line
-    gene_name = next((x.strip() for x in lsplt[8].split(";") if x.strip().startswith("Name=")), '').split('=')[-1]
-    if check_gene_name(gene_name):
-        return gene_name
-    # try 'gene=' at current line
-    gene_name = next((x.strip() for x in lsplt[8].split(";") if x.strip().startswith("gene=")), '').split('=')[-1]
-    if check_gene_name(gene_name):
-        return gene_name
-    # try 'product=' at next line
-    gene_name = next((x.strip() for x in lines[idx+1].strip().split()[8].split(";") if x.strip().startswith("product=")), None)
-    if gene_name is not None:
-        return product_to_gene_name(gene_name.split('=')[-1])
-    raise Exception(f'Unknown file format, cannot retrieve gene names')
+    def get_lengths(self) -> List[int]:
+        return [g.get_length(self.length) for g in self.genes]
 
+    def set_scaled_lengths(self, lengths: List[int], unit: float):
+        for gene, length in zip(self.genes, lengths):
+            gene.scaled_length = max(1, int(ceil(length / unit)))
 
-def parse_gff(filepath: str, to_skip: List[str]) -> List[Gene]:
-    genes = []
-    with open(filepath, 'rt') as f:
-        lines = f.readlines()
-    lines = [line for line in lines if not line.startswith('#') and len(line.split()) >= 9]
-    for idx, line in enumerate(lines):
+
+def get_unit(lengths: Iterable[Sequence[int]]) -> float:
+    return max(max(genome_lengths) for genome_lengths in lengths) / 10.
+
+
+def get_intergenic_regions(starts: Sequence[int], ends: Sequence[int], length: int,
+                           intergenic: int) -> List[Tuple[int, int, int]]:
+    # (index of the next gene, start, end) of the regions >= intergenic between genes ordered by start
+    regions = []
+    for i in range(1, len(starts)):
+        if starts[i] < ends[i - 1] < ends[i]:
+            # overlap
+            continue
+        region_length = starts[i] - ends[i - 1]
+        if region_length < 0:
+            region_length += length
+        if region_length >= intergenic:
+            regions.append((i, ends[i - 1], starts[i]))
+    # fill the gap between last gene and total length
+    if ends[-1] < length and length - ends[-1] >= intergenic:
+        regions.append((len(starts), ends[-1], length))
+    return regions
+
+
+def get_start_index(names: Sequence[str], start: str, linear: bool, species: str) -> int:
+    if linear:
+        return 0
+    lower_start = start.lower()
+    start_idx = next((i for i, name in enumerate(names) if lower_start in name.lower()), -1)
+    if start_idx == -1:
+        logging.warning(f'Start gene {start} not found in {species}, will use first gene found')
+        start_idx = 0
+    return start_idx
+
+
+def open_text(filepath: Union[str, TextIO]) -> TextIO:
+    # already opened text streams are read as is, but not closed
+    if not isinstance(filepath, str):
+        return nullcontext(filepath)
+    # detect gzip/bz2 input from the magic bytes rather than the file extension
+    with open(filepath, 'rb') as f:
+        magic = f.read(3)
+    if magic[:2] == b'\x1f\x8b':
+        return gzip.open(filepath, 'rt')
+    if magic == b'BZh':
+        return bz2.open(filepath, 'rt')
+    return open(filepath, 'rt')
+
+
+def parse_attributes(column: str) -> Dict[str, str]:
+    attributes = {}
+    for field in column.split(';'):
+        key, sep, value = field.strip().partition('=')
+        if sep and key not in attributes:
+            attributes[key] = value
+    return attributes
+
+
+def parse_position(value: str, filepath: Union[str, TextIO], line_number: int) -> int:
+    # a file saved half way, in watch mode, may hold anything in its coordinates
+    try:
+        return int(value)
+    except ValueError:
+        raise MtSVGError(f'Wrong position {value} in {getattr(filepath, "name", filepath)} line {line_number}') \
+            from None
+
+
+def get_gene_name(attributes: Dict[str, str]) -> Optional[str]:
+    # try 'Name=' then 'gene=', None means the name must come from the next line 'product='
+    for key in ('Name', 'gene'):
+        gene_name = attributes.get(key, '')
+        if check_gene_name(gene_name):
+            return normalize_gene_name(gene_name)
+    return None
+
+
+def read_gff(filepath: Union[str, TextIO], to_skip: List[str] = ()) -> Iterator[MtGenome]:
+    # a gff, or a GenBank flatfile when it starts with a LOCUS line
+    with open_text(filepath) as f:
+        first_line = f.readline()
+        lines = chain([first_line], f)
+        if first_line.startswith('LOCUS'):
+            yield from read_genbank_lines(lines, to_skip, filepath)
+        else:
+            yield from read_gff_lines(lines, to_skip, filepath)
+
+
+def read_gff_lines(lines: Iterable[str], to_skip: List[str], filepath: Union[str, TextIO]) -> Iterator[MtGenome]:
+    # single pass over the lines yielding one genome per seqid, records are expected to be contiguous
+    to_skip, lengths = tuple(to_skip), {}
+    seqid, species, genes, pending = None, None, [], None
+
+    def make_genome() -> MtGenome:
+        kept = [gene for gene in genes if not gene.name.startswith(to_skip)]
+        kept.sort(key=lambda x: x.start)
+        length = lengths.get(seqid, max((gene.end for gene in genes), default=0))
+        return MtGenome(species or seqid, length, kept)
+
+    for line_number, line in enumerate(lines, 1):
+        if line.startswith('#'):
+            if line.startswith('##sequence-region'):
+                fields = line.split()
+                if len(fields) >= 4:
+                    lengths[fields[1]] = parse_position(fields[3], filepath, line_number)
+            continue
         lsplt = line.strip().split('\t')
+        if len(lsplt) < 9:
+            continue
+        attributes = parse_attributes(lsplt[8])
+        # GenBank converted gene waiting for the 'product=' of this line
+        if pending is not None:
+            if 'product' not in attributes:
+                raise MtSVGError(f'Unknown file format, cannot retrieve gene names')
+            pending.name = product_to_gene_name(unquote(attributes['product']))
+            pending = None
+        if lsplt[0] != seqid:
+            if seqid is not None:
+                yield make_genome()
+            seqid, species, genes = lsplt[0], None, []
+        feature = lsplt[2].lower()
         is_mitos = lsplt[1].lower().startswith('mit')
-        if is_mitos and lsplt[2].lower() in GENE_CLASSES_MITOS:
-            gene_name = next((x.strip() for x in lsplt[8].split(";") if x.strip().startswith("Name=")), None)
+        if is_mitos and feature in GENE_CLASSES_MITOS:
+            gene_name = attributes.get('Name', attributes.get('gene_id'))
             if gene_name is None:
-                gene_name = next((x.strip() for x in lsplt[8].split(";") if x.strip().startswith("gene_id=")), None)
-            genes.append(Gene(gene_name.split('=')[-1], lsplt[6], int(lsplt[3]), int(lsplt[4])))
-        elif not is_mitos and lsplt[2].lower() in GENE_CLASSES_GENEBANK:
-            gene_name = get_gene_name(lines, idx)
-            genes.append(Gene(gene_name, lsplt[6], int(lsplt[3]), int(lsplt[4])))
-        else:
-            continue
-    # filter out genes to skip and order by start
-    genes_filtered = []
-    for gene in genes:
-        if not any([gene.name.startswith(s) for s in to_skip]):
-            genes_filtered.append(gene)
-    genes_filtered.sort(key=lambda x: x.start)
-    return genes_filtered
+                raise MtSVGError(f'Cannot retrieve gene name in {filepath}: {line.strip()}')
+            genes.append(Gene(normalize_gene_name(gene_name), lsplt[6], parse_position(lsplt[3], filepath, line_number),
+                              parse_position(lsplt[4], filepath, line_number)))
+        elif not is_mitos and feature in GENE_CLASSES_GENEBANK:
+            gene = Gene(get_gene_name(attributes), lsplt[6], parse_position(lsplt[3], filepath, line_number),
+                        parse_position(lsplt[4], filepath, line_number))
+            if gene.name is None:
+                pending = gene
+            genes.append(gene)
+        elif feature == 'region':
+            if 'organism' in attributes:
+                species = unquote(attributes['organism'])
+            if parse_position(lsplt[3], filepath, line_number) == 1:
+                lengths.setdefault(seqid, parse_position(lsplt[4], filepath, line_number))
+    if pending is not None:
+        raise MtSVGError(f'Unknown file format, cannot retrieve gene names')
+    if seqid is not None:
+        yield make_genome()
+
+
+def merge_records(records: Iterable[MtGenome]) -> List[Gene]:
+    # all the genes of the records whatever their seqid, ordered by start
+    genes = [gene for genome in records for gene in genome.genes]
+    genes.sort(key=lambda x: x.start)
+    return genes
+
+
+def parse_gff(filepath: str, to_skip: List[str]) -> List[Gene]:
+    return merge_records(read_gff(filepath, to_skip))
+
+
+def iter_genomes(entry: Tuple[str, int, str, bool], to_skip: List[str], cache: 'GenomeCache' = None) -> Iterator[MtGenome]:
+    records = read_gff(entry[2], to_skip) if cache is None else cache.load(entry[2], to_skip)
+    return iter_entry_genomes(entry, records)
+
+
+def iter_entry_genomes(entry: Tuple[str, int, str, bool], records: Iterable[MtGenome]) -> Iterator[MtGenome]:
+    species, size, _, is_reversed = entry
+    if species is not None and size is not None:
+        yield MtGenome(species, size, merge_records(records), is_reversed)
+        return
+    # missing species or size, one genome per record using the names and lengths found in the file
+    for genome in records:
+        yield MtGenome(species or genome.species, size or genome.length, genome.genes, is_reversed)
+
+
+def load_genomes(entry: Tuple[str, int, str, bool], to_skip: List[str], cache: 'GenomeCache' = None) -> List[MtGenome]:
+    return list(iter_genomes(entry, to_skip, cache))
+
+
+def get_skip_list(to_skip: str) -> List[str]:
+    return [] if to_skip is None else [s.strip() for s in to_skip.split(',')]
+
+
+def get_source_id(source: Union[str, TextIO]) -> tuple:
+    return ('path', os.path.abspath(source)) if isinstance(source, str) else ('stream', id(source))
+
 
+def read_records(source: Union[str, TextIO], to_skip: List[str], cache: 'GenomeCache' = None) -> List[MtGenome]:
+    with profile_stage('parse_gff', source if isinstance(source, str) else None):
+        return list(read_gff(source, to_skip)) if cache is None else cache.load(source, to_skip)
 
-def get_genomes(species: List[Tuple[str, int, str, bool]], start: str, intergenic: int, linear: bool, to_skip: str) -> List[MtGenome]:
-    to_skip = [] if to_skip is None else [s.strip() for s in to_skip.split(',')]
-    tmp_genomes, genomes, max_length = [MtGenome(sp[0], sp[1], parse_gff(sp[2], to_skip)) for sp in species], [], -1
+
+def iter_entries_genomes(species: List[Tuple[str, int, str, bool]], to_skip: List[str], cache: 'GenomeCache' = None,
+                         jobs: int = None) -> Iterator[List[MtGenome]]:
+    # the genomes of each entry in order, each distinct gff being read once by a pool of jobs threads
+    sources = {}
+    for entry in species:
+        sources.setdefault(get_source_id(entry[2]), entry[2])
+    remaining = Counter(get_source_id(entry[2]) for entry in species)
+    # the allocations of a profiled stage are process wide, they are only its own when the files are read one at a time
+    traced = PROFILER is not None and PROFILER.trace_memory
+    executor = None if jobs == 1 or traced or len(sources) < 2 else ThreadPoolExecutor(max_workers=jobs)
+    try:
+        # the sources are listed in the order of their first entry, so results are consumed as they are needed
+        read = lambda source: read_records(source, to_skip, cache)
+        parsed = map(read, sources.values()) if executor is None else executor.map(read, sources.values())
+        records = {}
+        for entry in species:
+            source_id = get_source_id(entry[2])
+            if source_id not in records:
+                records[source_id] = entry_records = next(parsed)
+            else:
+                # arranging a genome modifies its genes, a gff drawn several times gets its own copies
+                entry_records = copy.deepcopy(records[source_id])
+            remaining[source_id] -= 1
+            if remaining[source_id] == 0:
+                del records[source_id]
+            yield list(iter_entry_genomes(entry, entry_records))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def get_genomes(species: List[Tuple[str, int, str, bool]], start: str, intergenic: int, linear: bool, to_skip: str,
+                cache: 'GenomeCache' = None, compact: bool = False, jobs: int = None) -> List[MtGenome]:
+    genomes = []
+    for loaded in iter_entries_genomes(species, get_skip_list(to_skip), cache, jobs):
+        genomes.extend(map(CompactMtGenome.from_genome, loaded) if compact else loaded)
+    return arrange_genomes(genomes, start, intergenic, linear)
+
+
+def arrange_genomes(tmp_genomes: List[MtGenome], start: str, intergenic: int, linear: bool,
+                    unit: float = None) -> List[MtGenome]:
+    genomes, max_length = [], -1
 
     # filter out genomes with no genes
     for genome in tmp_genomes:
-        if len(genome.genes) > 0:
+        if genome.get_nb_genes() > 0:
             genomes.append(genome)
         else:
             logging.warning(f'No gene found for {genome.species}, removed from the drawing')
 
     # stop if no genome
     if len(genomes) == 0:
-        sys.exit('Error : no gene found in any genome')
-
-    # add intergenic regions
-    if intergenic > 0:
-        for genome in genomes:
-            for i in range(len(genome.genes) - 1, 0, -1):
-                if genome.genes[i].start < genome.genes[i - 1].end < genome.genes[i].end:
-                    # overlap
-                    continue
-                region_length = genome.genes[i].start - genome.genes[i - 1].end
-                if region_length < 0:
-                    region_length = genome.genes[i].start + genome.length - genome.genes[i - 1].end
-                if region_length >= intergenic:
-                    genome.genes.insert(i, Gene('intergenic', None, genome.genes[i - 1].end, genome.genes[i].start))
-                    i -= 1
-            # fill the gap between last gene and total length
-            if genome.genes[-1].end < genome.length and genome.length - genome.genes[-1].end >= intergenic:
-                genome.genes.append(Gene('intergenic', None, genome.genes[-1].end, genome.length))
-    # reverse
-    for i in range(len(species)):
-        if species[i][3]:
-            genomes[i].genes.reverse()
-            for gene in genomes[i].genes:
-                gene.orientation = '+' if gene.orientation == '-' else '-'
-
-    # align to start gene
-    for genome in genomes:
-        start_idx = -1
-        if linear and genome.length > 0:
-            start = genome.genes[0].name
-        for i in range(0, len(genome.genes)):
-            if start.lower() in genome.genes[i].name.lower():
-                start_idx = i
-                break
-        if start_idx == -1:
-            logging.warning(f'Start gene {start} not found in {genome.species}, will use first gene found')
-            start_idx = 0
-        new_genes = []
-        for i in range(start_idx, len(genome.genes)):
-            new_genes.append(genome.genes[i])
-            max_length = max(max_length, genome.genes[i].get_length(genome.length))
-        for i in range(0, start_idx):
-            new_genes.append(genome.genes[i])
-            max_length = max(max_length, genome.genes[i].get_length(genome.length))
-        genome.genes = new_genes
-
-    # compute scaled length from min 1 to max 10
-    unit = max_length / 10.
+        raise MtSVGError('no gene found in any genome')
+
     for genome in genomes:
-        for gene in genome.genes:
-            gene.scaled_length = max(1, int(ceil(gene.get_length(genome.length) / unit)))
+        with profile_stage('arrange', genome.species):
+            if intergenic > 0:
+                genome.add_intergenic(intergenic)
+            if genome.reversed:
+                genome.reverse()
+            genome.rotate(genome.get_start_index(start, linear))
+
+    # compute scaled length from min 1 to max 10, unless the unit of a larger set of genomes is given
+    with profile_stage('scale'):
+        lengths = [genome.get_lengths() for genome in genomes]
+        if unit is None:
+            unit = get_unit(lengths)
+        for genome, genome_lengths in zip(genomes, lengths):
+            genome.set_scaled_lengths(genome_lengths, unit)
 
     return genomes
 
 
+# ----------------------------- GENBANK PARSING -----------------------------
+
+GENBANK_FEATURES = set(['gene', 'trna', 'rrna'])
+GENBANK_QUALIFIERS = set(['gene', 'product'])
+GENBANK_EXTENSIONS = ('.gb', '.gbk', '.gbff', '.gb.gz', '.gbk.gz', '.gbff.gz', '.gb.bz2', '.gbk.bz2', '.gbff.bz2')
+GENBANK_POSITION = re.compile(r'\d+')
+GENBANK_LOCATION = re.compile(r'(?:complement|join|order|[0-9.<>^,()])+')
+FEATURE_COLUMN = 21  # column of the locations and qualifiers of the features table
+
+
+def get_location_span(location: str, length: int) -> Tuple[int, int, str]:
+    # start, end and strand of a feature location, the end is before the start when the feature wraps the origin
+    if not GENBANK_LOCATION.fullmatch(location):
+        raise MtSVGError(f'Cannot read the location {location}')
+    strand = '-' if 'complement' in location else '+'
+    parts = [[int(p) for p in GENBANK_POSITION.findall(part)] for part in location.split(',')]
+    starts, ends = [part[0] for part in parts if part], [part[-1] for part in parts if part]
+    if not starts:
+        raise MtSVGError(f'Cannot read the location {location}')
+    if len(parts) > 1 and length in ends and 1 in starts:
+        return starts[ends.index(length)], ends[starts.index(1)], strand
+    return min(starts), max(ends), strand
+
+
+def get_feature_name(qualifiers: Dict[str, str]) -> Optional[str]:
+    # try '/gene=' then '/product=', None when neither gives a known gene name
+    gene_name = qualifiers.get('gene', '')
+    if check_gene_name(gene_name):
+        return normalize_gene_name(gene_name)
+    if 'product' in qualifiers:
+        try:
+            return product_to_gene_name(qualifiers['product'])
+        except MtSVGError:
+            return None
+    return None
+
+
+def get_genbank_genes(locus: str, length: int, features: List[Tuple[str, Dict[str, str], int]],
+                      to_skip: Tuple[str, ...], filepath: Union[str, TextIO]) -> List[Gene]:
+    # the gene features and the tRNA or rRNA features of the same location are a single gene,
+    # each feature comes with the number of its first line
+    genes = {}
+    for location, qualifiers, line_number in features:
+        try:
+            start, end, strand = get_location_span(location, length)
+        except MtSVGError as e:
+            raise MtSVGError(f'{e} in {getattr(filepath, "name", filepath)} line {line_number}') from None
+        gene = genes.get((start, end, strand))
+        if gene is None:
+            genes[(start, end, strand)] = Gene(get_feature_name(qualifiers), strand, start, end)
+        elif gene.name is None:
+            gene.name = get_feature_name(qualifiers)
+    kept = []
+    for gene in genes.values():
+        if gene.name is None:
+            logging.warning(f'Cannot retrieve the name of the gene {gene.start}..{gene.end} of {locus}, '
+                            f'removed from the drawing')
+        elif not gene.name.startswith(to_skip):
+            kept.append(gene)
+    kept.sort(key=lambda x: x.start)
+    return kept
+
+
+def read_genbank_lines(lines: Iterable[str], to_skip: List[str], filepath: Union[str, TextIO]) -> Iterator[MtGenome]:
+    # single pass over the lines of a GenBank flatfile yielding one genome per record, the sequence is skipped
+    to_skip = tuple(to_skip)
+    locus, length, species, features = None, 0, None, []
+    section, qualifiers, qualifier, in_location = None, None, None, False
+    for line_number, line in enumerate(lines, 1):
+        if section == 'ORIGIN' and not line.startswith('//'):
+            continue
+        if line.startswith('//'):
+            yield MtGenome(species or locus, length, get_genbank_genes(locus, length, features, to_skip, filepath))
+            locus, length, species, features = None, 0, None, []
+            section, qualifiers, qualifier, in_location = None, None, None, False
+        elif line.startswith('LOCUS'):
+            fields = line.split()
+            locus = fields[1] if len(fields) > 1 else None
+            length = int(fields[2]) if len(fields) > 2 and fields[2].isdigit() else 0
+            section = 'LOCUS'
+        elif not line.startswith(' '):
+            section = line.split(None, 1)[0] if line.strip() else section
+        elif section == 'SOURCE' and line.startswith('  ORGANISM'):
+            species = line[12:].strip()
+        elif section == 'FEATURES' and line[5:6].strip():
+            # new feature, only the gene, tRNA and rRNA ones are kept
+            fields = line.split()
+            qualifiers, qualifier, in_location = None, None, True
+            if fields[0].lower() in GENBANK_FEATURES and len(fields) > 1:
+                qualifiers = {}
+                features.append([fields[1], qualifiers, line_number])
+        elif section == 'FEATURES' and qualifiers is not None:
+            text = line[FEATURE_COLUMN:].strip()
+            if text.startswith('/'):
+                key, _, value = text[1:].partition('=')
+                qualifier, in_location = key if key in GENBANK_QUALIFIERS else None, False
+                if qualifier is not None:
+                    qualifiers[key] = value.strip('"')
+            elif in_location:
+                # location continued on the next lines
+                features[-1][0] += text
+            elif qualifier is not None:
+                # value continued on the next lines
+                qualifiers[qualifier] = (qualifiers[qualifier] + ' ' + text).strip('"')
+    if locus is not None:
+        yield MtGenome(species or locus, length, get_genbank_genes(locus, length, features, to_skip, filepath))
+
+
+# ----------------------------- GENE ORDER -----------------------------
+
+MAX_SHARED_SPECIES = 10  # species listed in the label of an arrangement, the others are counted
+
+
+def get_gene_order(genome: MtGenome) -> List[str]:
+    # clean name and strand of each gene, intergenic regions aside
+    return [get_clean_name(gene.name).lower() + (gene.orientation or '.')
+            for gene in genome.genes if gene.name != 'intergenic']
+
+
+def get_reverse_order(tokens: Sequence[str]) -> List[str]:
+    # the gene order read from the other strand
+    return [token[:-1] + {'+': '-', '-': '+'}.get(token[-1], token[-1]) for token in reversed(tokens)]
+
+
+def get_least_rotation(tokens: Sequence[str]) -> int:
+    # Booth's algorithm, start index of the lexicographically least rotation in linear time
+    doubled, k = list(tokens) * 2, 0
+    failure = [-1] * len(doubled)
+    for j in range(1, len(doubled)):
+        token, i = doubled[j], failure[j - k - 1]
+        while i != -1 and token != doubled[k + i + 1]:
+            if token < doubled[k + i + 1]:
+                k = j - i - 1
+            i = failure[i]
+        if token != doubled[k + i + 1]:
+            if token < doubled[k]:
+                k = j
+            failure[j - k] = -1
+        else:
+            failure[j - k] = i + 1
+    return k
+
+
+def get_arrangement_signature(genome: MtGenome, rotation: bool = True) -> str:
+    # hash of the gene order, the same for the reverse complement and, unless linear, for any rotation
+    tokens = get_gene_order(genome)
+    candidates = []
+    for order in (tokens, get_reverse_order(tokens)):
+        start = get_least_rotation(order) if rotation and order else 0
+        candidates.append(order[start:] + order[:start])
+    return hashlib.sha1(' '.join(min(candidates)).encode()).hexdigest()
+
+
+def index_arrangements(genomes: Iterable[MtGenome], rotation: bool = True) -> Dict[str, List[MtGenome]]:
+    # signature -> genomes sharing the gene order, in the order of their first genome
+    index = {}
+    for genome in genomes:
+        index.setdefault(get_arrangement_signature(genome, rotation), []).append(genome)
+    return index
+
+
+def get_arrangement_label(group: List[MtGenome]) -> str:
+    species = [genome.species for genome in group[:MAX_SHARED_SPECIES]]
+    if len(group) > MAX_SHARED_SPECIES:
+        return ', '.join(species) + f' and {len(group) - MAX_SHARED_SPECIES} more'
+    return ', '.join(species)
+
+
+def get_unique_arrangements(genomes: List[MtGenome], rotation: bool = True) -> List[MtGenome]:
+    # the first genome of each gene order, labeled with the species sharing it
+    unique = []
+    with profile_stage('unique'):
+        for group in index_arrangements(genomes, rotation).values():
+            genome = copy.copy(group[0])
+            genome.species = get_arrangement_label(group)
+            unique.append(genome)
+    return unique
+
+
+def get_adjacencies(genome: MtGenome, circular: bool = True) -> set:
+    # pairs of neighbouring genes, the same whatever the strand they are read from
+    tokens = get_gene_order(genome)
+    adjacencies = set()
+    for pair in zip(tokens, tokens[1:] + tokens[:1] if circular else tokens[1:]):
+        adjacencies.add(min(pair, tuple(get_reverse_order(pair))))
+    return adjacencies
+
+
+SORT_ADJACENCIES = 8  # rarest adjacencies of the last genome ordered looked up for the next one
+SORT_CANDIDATES = 32  # genomes taken from each of them
+
+
+def sort_by_similarity(genomes: List[MtGenome], circular: bool = True) -> List[MtGenome]:
+    # greedy nearest neighbour ordering on the breakpoint distance, starting from the first genome. Genomes sharing
+    # a gene order are kept together and compared once. The candidates of each step are a few genomes sharing the
+    # rarest adjacencies of the last genome ordered, so a step costs the same however many genomes are alike
+    with profile_stage('sort'):
+        groups = list(index_arrangements(genomes, circular).values())
+        # adjacencies numbered, integer sets being faster to intersect
+        numbers = defaultdict(lambda: len(numbers))
+        adjacencies = [frozenset(numbers[adjacency] for adjacency in get_adjacencies(group[0], circular))
+                       for group in groups]
+        index = [set() for _ in range(len(numbers))]
+        for i, group_adjacencies in enumerate(adjacencies):
+            for adjacency in group_adjacencies:
+                index[adjacency].add(i)
+
+        current, order, ordered, first_remaining = 0, [0], [False] * len(groups), 0
+        ordered[0] = True
+        for _ in range(1, len(groups)):
+            last = adjacencies[current]
+            for adjacency in last:
+                index[adjacency].discard(current)
+            rarest = sorted((len(index[adjacency]), adjacency) for adjacency in last if index[adjacency])
+            candidates = set(chain.from_iterable(islice(index[adjacency], SORT_CANDIDATES)
+                                                 for _, adjacency in rarest[:SORT_ADJACENCIES]))
+            if candidates:
+                size = len(last)
+                current = min(candidates, key=lambda i: (max(size, len(adjacencies[i])) - len(last & adjacencies[i]), i))
+            else:
+                # nothing in common with the remaining genomes, the first one in the config order
+                while ordered[first_remaining]:
+                    first_remaining += 1
+                current = first_remaining
+            ordered[current] = True
+            order.append(current)
+    return [genome for i in order for genome in groups[i]]
+
+
+# ----------------------------- COMPACT GENOMES -----------------------------
+
+class Interner:
+    # maps the values to small integer ids shared by all the genomes
+
+    def __init__(self, values: Iterable = ()):
+        self.values, self.ids = [], {}
+        for value in values:
+            self.get_id(value)
+
+    def get_id(self, value) -> int:
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+
+GENE_NAME_IDS = Interner(['intergenic'])
+ORIENTATION_IDS = Interner(['+', '-', None])
+
+
+class CompactMtGenome:
+    # column oriented MtGenome, genes are only materialized as Gene objects when drawn
+
+    def __init__(self, species: str, length: int, name_ids: array, orientations: array, starts: array, ends: array,
+                 reversed: bool = False):
+        self.species = species
+        self.length = length
+        self.name_ids = name_ids
+        self.orientations = orientations
+        self.starts = starts
+        self.ends = ends
+        self.reversed = reversed
+        self.scaled_lengths = array('l')
+
+    @classmethod
+    def from_genome(cls, genome: MtGenome) -> 'CompactMtGenome':
+        return cls(genome.species, genome.length,
+                   array('I', [GENE_NAME_IDS.get_id(g.name) for g in genome.genes]),
+                   array('B', [ORIENTATION_IDS.get_id(g.orientation) for g in genome.genes]),
+                   array('q', [g.start for g in genome.genes]),
+                   array('q', [g.end for g in genome.genes]),
+                   genome.reversed)
+
+    @property
+    def genes(self) -> List[Gene]:
+        names, orientations = GENE_NAME_IDS.values, ORIENTATION_IDS.values
+        scaled_lengths = self.scaled_lengths if len(self.scaled_lengths) == len(self.starts) else repeat(None)
+        return [Gene(names[n], orientations[o], s, e, sl) for n, o, s, e, sl
+                in zip(self.name_ids, self.orientations, self.starts, self.ends, scaled_lengths)]
+
+    def to_genome(self) -> MtGenome:
+        # the genes materialized once, for the drawing that reads them several times
+        return MtGenome(self.species, self.length, self.genes, self.reversed)
+
+    def get_scaled_length(self) -> int:
+        return sum(self.scaled_lengths)
+
+    def get_nb_genes(self) -> int:
+        return len(self.starts)
+
+    def add_intergenic(self, intergenic: int):
+        regions = get_intergenic_regions(self.starts, self.ends, self.length, intergenic)
+        columns = (self.name_ids, self.orientations, self.starts, self.ends)
+        new_columns = tuple(array(column.typecode) for column in columns)
+        intergenic_id, none_id, previous = GENE_NAME_IDS.get_id('intergenic'), ORIENTATION_IDS.get_id(None), 0
+        for i, region_start, region_end in regions:
+            for column, new_column, value in zip(columns, new_columns, (intergenic_id, none_id, region_start, region_end)):
+                new_column.extend(column[previous:i])
+                new_column.append(value)
+            previous = i
+        for column, new_column in zip(columns, new_columns):
+            new_column.extend(column[previous:])
+        self.name_ids, self.orientations, self.starts, self.ends = new_columns
+
+    def reverse(self):
+        # anything but '-' becomes '-' like in MtGenome.reverse
+        plus_id, minus_id = ORIENTATION_IDS.get_id('+'), ORIENTATION_IDS.get_id('-')
+        flipped = bytes(plus_id if value == '-' else minus_id for value in ORIENTATION_IDS.values).ljust(256, b'\0')
+        self.name_ids.reverse()
+        self.starts.reverse()
+        self.ends.reverse()
+        self.orientations = array('B', self.orientations.tobytes()[::-1].translate(flipped))
+
+    def get_start_index(self, start: str, linear: bool) -> int:
+        if linear:
+            return 0
+        # test each distinct name once
+        lower_start, names = start.lower(), GENE_NAME_IDS.values
+        matches = {name_id for name_id in set(self.name_ids) if lower_start in names[name_id].lower()}
+        if matches:
+            return next(i for i, name_id in enumerate(self.name_ids) if name_id in matches)
+        logging.warning(f'Start gene {start} not found in {self.species}, will use first gene found')
+        return 0
+
+    def rotate(self, start_idx: int):
+        for name in ('name_ids', 'orientations', 'starts', 'ends'):
+            column = getattr(self, name)
+            setattr(self, name, column[start_idx:] + column[:start_idx])
+
+    def get_lengths(self) -> array:
+        # end - start, wrapping around the origin of the genome when negative, only the wrapping genes being fixed
+        lengths = array('q', map(sub, self.ends, self.starts))
+        if lengths and min(lengths) < 0:
+            lengths = array('q', [d if d >= 0 else d + self.length for d in lengths])
+        return lengths
+
+    def set_scaled_lengths(self, lengths: array, unit: float):
+        self.scaled_lengths = array('l', map(max, repeat(1), map(ceil, map(truediv, lengths, repeat(unit)))))
+
+
+# ----------------------------- CACHE -----------------------------
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'mtSVG')
+DEFAULT_CACHE_SIZE = 256  # MB
+
+
+def get_source_key(source: Union[str, TextIO], to_skip: List[str]) -> Optional[tuple]:
+    # identifies the content of a gff path or of an in-memory text, None if it cannot be identified
+    if isinstance(source, str):
+        stat = os.stat(source)
+        source_key = (os.path.abspath(source), stat.st_mtime_ns, stat.st_size)
+    elif hasattr(source, 'getvalue'):
+        source_key = ('sha1', hashlib.sha1(source.getvalue().encode()).hexdigest())
+    else:
+        return None
+    return (CACHE_VERSION, source_key, tuple(to_skip), tuple(sorted(GENE_SYNONYMS.items())))
+
+
+def to_records(genomes: Iterable[MtGenome]) -> list:
+    return [(genome.species, genome.length, [(gene.name, gene.orientation, gene.start, gene.end)
+                                             for gene in genome.genes]) for genome in genomes]
+
+
+def from_records(records: list) -> List[MtGenome]:
+    return [MtGenome(species, length, [Gene(*gene) for gene in genes]) for species, length, genes in records]
+
+
+class GenomeCache:
+    # parsed records of the gff files, one zlib compressed pickle of plain tuples per (file, skip list)
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_size: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_size * 1024 * 1024
+        self.total_bytes = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, filepath: Union[str, TextIO], to_skip: List[str]) -> Optional[str]:
+        key = get_source_key(filepath, to_skip)
+        return None if key is None else hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get_entries(self) -> List[os.DirEntry]:
+        return [entry for entry in os.scandir(self.directory) if entry.is_file() and entry.name.endswith('.mtc')]
+
+    def load(self, filepath: Union[str, TextIO], to_skip: List[str]) -> List[MtGenome]:
+        key = self.get_key(filepath, to_skip)
+        if key is None:
+            return list(read_gff(filepath, to_skip))
+        path = os.path.join(self.directory, key + '.mtc')
+        try:
+            with open(path, 'rb') as f:
+                records = pickle.loads(zlib.decompress(f.read()))
+            # refresh the modification time used as last access by the eviction
+            os.utime(path)
+            return from_records(records)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f'Ignoring unreadable cache entry {path}: {e}')
+        genomes = list(read_gff(filepath, to_skip))
+        self.store(path, zlib.compress(pickle.dumps(to_records(genomes), protocol=pickle.HIGHEST_PROTOCOL)))
+        return genomes
+
+    def store(self, path: str, data: bytes):
+        # write then rename so that concurrent processes never read a partial entry
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        # the gffs of a config are read by several threads
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(entry.stat().st_size for entry in self.get_entries())
+            else:
+                self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self.prune()
+
+    def prune(self):
+        # evict the least recently used entries until the cache fits in max_bytes
+        entries = sorted(self.get_entries(), key=lambda entry: entry.stat().st_mtime)
+        self.total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(entry.path)
+                self.total_bytes -= entry.stat().st_size
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for entry in self.get_entries():
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        self.total_bytes = 0
+
+
+# ----------------------------- CATALOG -----------------------------
+
+CATALOG_VERSION = 1
+CATALOG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS genomes (id INTEGER PRIMARY KEY, source TEXT, species TEXT, length INTEGER,
+                                    reversed INTEGER, signature TEXT);
+CREATE TABLE IF NOT EXISTS genes (genome INTEGER, position INTEGER, name TEXT, orientation TEXT, start_pos INTEGER,
+                                  end_pos INTEGER, clean TEXT, strand TEXT, next TEXT);
+CREATE INDEX IF NOT EXISTS genomes_source ON genomes (source);
+CREATE INDEX IF NOT EXISTS genomes_signature ON genomes (signature);
+CREATE INDEX IF NOT EXISTS genes_genome ON genes (genome, position);
+CREATE INDEX IF NOT EXISTS genes_clean ON genes (clean, strand, genome);
+'''
+
+
+def open_catalog(filepath: str) -> sqlite3.Connection:
+    try:
+        connection = sqlite3.connect(filepath)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == 0:
+            connection.executescript(CATALOG_SCHEMA)
+            connection.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+        elif version != CATALOG_VERSION:
+            connection.close()
+            raise MtSVGError(f'catalog {filepath} was created by another version of mtSVG')
+        return connection
+    except sqlite3.Error as e:
+        raise MtSVGError(f'cannot open the catalog {filepath}: {e}')
+
+
+def get_catalog_genes(genome_id: int, genome: MtGenome) -> Iterator[tuple]:
+    # the genes as parsed, to draw them, and as read on the drawn strand, for the queries: lower case clean name,
+    # strand and clean name of the next gene, the order being circular
+    cleans = [get_clean_name(gene.name).lower() for gene in genome.genes]
+    for i, gene in enumerate(genome.genes):
+        if genome.reversed:
+            strand, next_clean = '+' if gene.orientation == '-' else '-', cleans[i - 1]
+        else:
+            strand, next_clean = gene.orientation, cleans[(i + 1) % len(cleans)]
+        yield genome_id, i, gene.name, gene.orientation, gene.start, gene.end, cleans[i], strand, next_clean
+
+
+def import_catalog(filepath: str, entries: List[Tuple[str, int, str, bool]], jobs: int = None) -> int:
+    # the genomes of the entries replace those previously imported from the same files, every gene is stored so
+    # that --skip applies when drawing. Returns the number of genomes imported
+    connection, nb_genomes, replaced = open_catalog(filepath), 0, set()
+    try:
+        with connection:
+            for entry, genomes in zip(entries, iter_entries_genomes(entries, [], None, jobs)):
+                source = os.path.abspath(entry[2])
+                with profile_stage('import', source):
+                    if source not in replaced:
+                        # several entries of a config file may share a file
+                        replaced.add(source)
+                        connection.execute('DELETE FROM genes WHERE genome IN '
+                                           '(SELECT id FROM genomes WHERE source = ?)', (source,))
+                        connection.execute('DELETE FROM genomes WHERE source = ?', (source,))
+                    for genome in genomes:
+                        cursor = connection.execute('INSERT INTO genomes (source, species, length, reversed, '
+                                                    'signature) VALUES (?, ?, ?, ?, ?)',
+                                                    (source, genome.species, genome.length, genome.reversed,
+                                                     get_arrangement_signature(genome)))
+                        connection.executemany('INSERT INTO genes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                               get_catalog_genes(cursor.lastrowid, genome))
+                        nb_genomes += 1
+    except sqlite3.Error as e:
+        raise MtSVGError(f'cannot write the catalog {filepath}: {e}')
+    finally:
+        connection.close()
+    return nb_genomes
+
+
+def get_query_condition(term: str) -> Tuple[str, list]:
+    # sql condition on the genomes table of a query term, see --query
+    negated, term = term.startswith('!'), term.lstrip('!')
+    # uncorrelated subqueries, evaluated once whatever the number of genomes
+    gene_condition = 'id IN (SELECT genome FROM genes WHERE clean = ?'
+    if term.startswith('species:'):
+        text = re.sub(r'([\\%_])', r'\\\1', term[len('species:'):])
+        condition, params = "species LIKE ? ESCAPE '\\'", [f'%{text}%']
+    elif term.startswith('order:'):
+        condition, params = 'signature IN (SELECT signature FROM genomes WHERE species = ?)', [term[len('order:'):]]
+    elif '>' in term:
+        first, _, second = term.partition('>')
+        condition, params = gene_condition + ' AND next = ?)', [first.lower(), second.lower()]
+    elif term.endswith(('+', '-')):
+        condition, params = gene_condition + ' AND strand = ?)', [term[:-1].lower(), term[-1]]
+    else:
+        condition, params = gene_condition + ')', [term.lower()]
+    if any(param in ('', '%%') for param in params):
+        raise MtSVGError(f'wrong query term: {term}')
+    return (f'NOT {condition}' if negated else condition), params
+
+
+def query_catalog(filepath: str, query: str = None, to_skip: List[str] = ()) -> List[MtGenome]:
+    # the genomes matching all the terms of the query, in the order they were imported
+    if not os.path.isfile(filepath):
+        raise MtSVGError(f'no catalog {filepath}')
+    conditions, params = ['1'], []
+    try:
+        terms = shlex.split(query or '')
+    except ValueError as e:
+        raise MtSVGError(f'wrong query {query}: {e}')
+    for term in terms:
+        condition, term_params = get_query_condition(term)
+        conditions.append(condition)
+        params.extend(term_params)
+    selection = 'SELECT id FROM genomes WHERE ' + ' AND '.join(conditions)
+    connection, to_skip = open_catalog(filepath), tuple(to_skip)
+    try:
+        with profile_stage('query', query):
+            rows = connection.execute(f'SELECT id, species, length, reversed FROM genomes WHERE id IN ({selection}) '
+                                      f'ORDER BY id', params).fetchall()
+            genes = connection.execute(f'SELECT genome, name, orientation, start_pos, end_pos FROM genes '
+                                       f'WHERE genome IN ({selection}) ORDER BY genome, position', params)
+            genome_genes = {genome_id: [Gene(*gene[1:]) for gene in group if not gene[1].startswith(to_skip)]
+                            for genome_id, group in groupby(genes, key=lambda gene: gene[0])}
+    except sqlite3.Error as e:
+        raise MtSVGError(f'cannot read the catalog {filepath}: {e}')
+    finally:
+        connection.close()
+    if len(rows) == 0:
+        raise MtSVGError(f'no genome of the catalog matches {query}')
+    return [MtGenome(species, length, genome_genes.get(genome_id, []), bool(is_reversed))
+            for genome_id, species, length, is_reversed in rows]
+
+
+def get_catalog_genomes(filepath: str, query: str, start: str, intergenic: int, linear: bool, to_skip: str,
+                        compact: bool = False) -> List[MtGenome]:
+    # get_genomes for the genomes of a catalog matching a query, the gffs are not read
+    genomes = query_catalog(filepath, query, get_skip_list(to_skip))
+    if compact:
+        genomes = [CompactMtGenome.from_genome(genome) for genome in genomes]
+    return arrange_genomes(genomes, start, intergenic, linear)
+
+
 # ----------------------------- DRAWING -----------------------------
 
 COLOR_SCHEMES = {'default': {'co': '#f2ed8d', 'cy': '#f2ed8d',
@@ -261,114 +1155,597 @@ class DrawableGenome:
     full_name: bool
     oriented: bool
     genome: MtGenome
+    optimized: bool = False
+    detail: int = 0
+    min_font_size: float = 0
+    window: Tuple[float, float] = None
+
+
+@dataclass
+class RenderOptions:
+    start: str = 'cox1'
+    intergenic: int = 0
+    linear: bool = False
+    skip: str = None
+    circular: bool = False
+    monochromatic: bool = False
+    font: str = 'Arial'
+    full_name: bool = False
+    oriented: bool = False
+    cache: str = None
+    cache_size: int = DEFAULT_CACHE_SIZE
+    synonyms: str = None
+    optimize: bool = False
+    precision: int = None
+    max_elements: int = None
+    zoom: float = None
+    unique: bool = False
+    sort: bool = False
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> 'RenderOptions':
+        return cls(**{f.name: getattr(args, f.name) for f in fields(cls)})
+
+
+def get_drawable(genome: MtGenome, i: int, options: RenderOptions) -> DrawableGenome:
+    # the i-th genome of the figure, a compact genome stays compact until materialize
+    color_scheme = COLOR_SCHEMES['monochromatic'] if options.monochromatic else COLOR_SCHEMES['default']
+    return DrawableGenome(Point(0, i * RIBBON_HEIGHT), color_scheme, options.font, options.full_name,
+                          options.oriented, genome, options.optimize, min_font_size=get_min_font_size(options.zoom))
+
+
+def materialize(drawable: DrawableGenome) -> DrawableGenome:
+    # the drawable with the genes of its compact genome as Gene objects, for the time of its count or layout only
+    if isinstance(drawable.genome, CompactMtGenome):
+        return replace(drawable, genome=drawable.genome.to_genome())
+    return drawable
+
+
+# color scheme -> memoized scheme keys of the gene names and orientations already seen
+COLOR_TABLES = {}
+CSS_CLASSES = {'+': 'plus', '-': 'minus', None: 'none'}
+
+
+def get_color_key(color_scheme: dict, key: str) -> Optional[str]:
+    scheme, color_keys = COLOR_TABLES.get(id(color_scheme), (None, None))
+    if scheme is not color_scheme:
+        color_keys = {}
+        COLOR_TABLES[id(color_scheme)] = (color_scheme, color_keys)
+    if key not in color_keys:
+        lower_key = key.lower()
+        color_keys[key] = next((k for k in color_scheme if lower_key.startswith(k)), None)
+    return color_keys[key]
 
 
 def get_color(color_scheme: dict, key: str) -> str:
-    return next((color_scheme[k] for k in color_scheme if key.lower().startswith(k)), '#ffffff')
+    color_key = get_color_key(color_scheme, key)
+    return '#ffffff' if color_key is None else color_scheme[color_key]
 
 
-def get_drawing(drawables: List[DrawableGenome], circular=False) -> draw.Drawing:
-    width = max([(drawable.genome.get_scaled_length() * SCALE_FACTOR) + len(drawable.genome.genes) * STROKE_WIDTH
-                 for drawable in drawables])
+def get_css_class(color_scheme: dict, key: str) -> str:
+    color_key = get_color_key(color_scheme, key)
+    return CSS_CLASSES.get(color_key, color_key)
+
+
+def style(drawable: DrawableGenome, css_classes: str, **inline) -> dict:
+    # css classes declared by get_optimized_defs in optimized mode, inline attributes otherwise
+    return {'class_': css_classes} if drawable.optimized else inline
+
+
+def get_optimized_defs(color_scheme: dict, font: str) -> draw.Raw:
+    # one css class per key of the color scheme, f- to fill and s- to stroke, plus the ribbon arrows
+    rules = [f"text{{font-family:'{font}'}}", '.species{font-style:italic;font-weight:bold}',
+             f'.gene{{stroke:black;stroke-width:{STROKE_WIDTH}}}',
+             f'.ring{{fill:none;stroke:black;stroke-width:{STROKE_WIDTH}}}',
+             f'.band{{fill:none;stroke:black;stroke-width:{RIBBON_HEIGHT / 2 - STROKE_WIDTH}}}',
+             f'.arc{{fill:none;stroke-width:{RIBBON_HEIGHT / 2 - STROKE_WIDTH}}}',
+             f'.bar{{fill:none;stroke-width:{ORIENTATION_HEIGHT / 2}}}']
+    for key, color in list(color_scheme.items()) + [(None, '#ffffff')]:
+        css_class = CSS_CLASSES.get(key, key)
+        rules.append(f'.f-{css_class}{{fill:{color}}}.s-{css_class}{{stroke:{color}}}')
+    arrows = ''.join(f'<path id="arrow-{CSS_CLASSES[o]}" d="M0,0L{sign * SCALE_FACTOR},{ORIENTATION_HEIGHT / 2}'
+                     f'L0,{ORIENTATION_HEIGHT}"/>' for o, sign in (('+', 1), ('-', -1)))
+    return draw.Raw(f'<style>{"".join(rules)}</style>\n<defs>{arrows}</defs>')
+
+
+class PrecisionDrawing:
+    # forwards the elements to a drawing once their coordinates are rounded to a number of decimals
+
+    NUMBER = re.compile(r'-?\d+\.\d+(?:e[-+]?\d+)?')
+
+    def __init__(self, drawing: draw.Drawing, precision: int):
+        self.drawing = drawing
+        self.precision = precision
+        self.width, self.height = drawing.width, drawing.height
+
+    def round(self, value: float) -> Union[int, float]:
+        value = round(value, self.precision)
+        return int(value) if value == int(value) else value
+
+    def round_numbers(self, text: str) -> str:
+        return self.NUMBER.sub(lambda m: str(self.round(float(m.group()))), text)
+
+    def append(self, element: draw.DrawingElement):
+        if isinstance(element, draw.Raw):
+            element.content = self.round_numbers(element.content)
+        args = getattr(element, 'args', {})
+        for key, value in args.items():
+            if isinstance(value, float):
+                args[key] = self.round(value)
+            elif isinstance(value, str):
+                args[key] = self.round_numbers(value)
+        self.drawing.append(element)
+
+
+def open_output(output: Union[str, TextIO]) -> TextIO:
+    # already opened text streams are written as is, but not closed, .svgz outputs are gzip compressed
+    if not isinstance(output, str):
+        return nullcontext(output)
+    if output.endswith('.svgz'):
+        return gzip.open(output, 'wt', encoding='utf-8')
+    return open(output, 'wt', encoding='utf-8')
+
+
+def write_drawing(drawing: draw.Drawing, output: Union[str, TextIO]):
+    with profile_stage('write', output if isinstance(output, str) else None) as stage:
+        with open_output(output) as f:
+            drawing.as_svg(f)
+    if stage is not None and isinstance(output, str):
+        stage.add(bytes=os.path.getsize(output))
+
+
+def get_ribbon_width(scaled_length: int, nb_genes: int) -> int:
+    return scaled_length * SCALE_FACTOR + nb_genes * STROKE_WIDTH
+
+
+def get_drawing_size(width: int, nb_genomes: int, circular=False) -> Tuple[int, int]:
     if circular:
         width = int(width / pi)
-        return draw.Drawing(width, width)
-    height = RIBBON_HEIGHT * len(drawables)
-    return draw.Drawing(width, height)
+        return width, width
+    return width, RIBBON_HEIGHT * nb_genomes
 
 
-def get_clean_name(gene_name: str) -> str:
-    try:
-        if gene_name.lower().startswith('trn') or gene_name.lower().startswith('rrn'):
-            return gene_name.split('_')[0].split('(')[0]
-        elif gene_name.lower().startswith('nad4') and len(gene_name) > 4:
-            return 'nad4L'
-        else:
-            return gene_name.split('_')[0].split('-')[0].lower()
-    except:
-        return gene_name
+def get_figure_size(drawables: List[DrawableGenome], circular=False) -> Tuple[int, int]:
+    width = max([get_ribbon_width(drawable.genome.get_scaled_length(), drawable.genome.get_nb_genes())
+                 for drawable in drawables])
+    return get_drawing_size(width, len(drawables), circular)
 
 
-#----------------------------- RIBBON -----------------------------#
 
-def draw_genome(drawable: DrawableGenome, drawing: draw.Drawing):
-    # draw species
-    species_font_size = SPECIES_HEIGHT * 0.75
-    drawing.append(draw.Text(drawable.genome.species + f' ({drawable.genome.length:,} bp)', species_font_size,
-                             drawable.origin.x,
-                             drawable.origin.y + species_font_size,
-                             font_family=drawable.font,
-                             font_style='italic',
-                             font_weight='bold'))
-    # draw genes
-    gene_origin = Point(drawable.origin.x + STROKE_WIDTH, drawable.origin.y + SPECIES_HEIGHT)
-    for gene in drawable.genome.genes:
-        gene_origin = draw_gene(drawable, gene, gene_origin, drawing)
-
-
-def draw_gene(drawable: DrawableGenome, gene: Gene, origin: Point, drawing: draw.Drawing) -> Point:
-    # draw gene
-    drawing.append(draw.Rectangle(origin.x, origin.y,
-                                  gene.scaled_length * SCALE_FACTOR, GENE_HEIGHT,
-                                  fill=get_color(drawable.color_scheme, gene.name),
-                                  stroke='black',
-                                  stroke_width=STROKE_WIDTH))
-
-    # draw gene name
+# ----------------------------- LEVEL OF DETAIL -----------------------------#
+
+# levels of detail, each one drawing fewer elements than the previous one
+DETAIL_FULL = 0          # every element
+DETAIL_LABELS = 1        # no rotated or shrunk gene names
+DETAIL_ORIENTATIONS = 2  # one orientation bar per run of consecutive genes on the same strand
+DETAIL_BLOCKS = 3        # one unlabeled block per run of consecutive genes of the same class
+DETAILS = range(DETAIL_FULL, DETAIL_BLOCKS + 1)
+READABLE_FONT_SIZE = 6   # pixels
+
+
+def get_min_font_size(zoom: float = None) -> float:
+    # the smallest font size, in drawing units, still readable once displayed at the zoom
+    return 0 if zoom is None else READABLE_FONT_SIZE / (PIXEL_SCALE * zoom)
+
+
+def get_label(drawable: DrawableGenome, gene: Gene, font_size: int,
+              width: float = None) -> Optional[Tuple[str, int, float, bool]]:
+    # name, font size, width and rotation of the gene name, None when dropped by the level of detail
     gene_name = gene.name if drawable.full_name else get_clean_name(gene.name)
-    font_size = int(GENE_HEIGHT / 3)
     gene_size = len(gene_name) * font_size / 2
-
-    if gene_size < gene.scaled_length * SCALE_FACTOR:
-        drawing.append(draw.Text(gene_name, font_size,
-                                 origin.x + ((gene.scaled_length * SCALE_FACTOR) - gene_size) / 2,
-                                 origin.y + (GENE_HEIGHT + font_size * 0.75) / 2,
-                                 font_family=drawable.font))
-    else:
+    rotated = gene_size >= (gene.scaled_length * SCALE_FACTOR if width is None else width)
+    if rotated:
+        if drawable.detail >= DETAIL_LABELS:
+            return None
         if gene_size > GENE_HEIGHT:
             font_size = int(2 * GENE_HEIGHT / len(gene_name))
             gene_size = len(gene_name) * font_size / 2
+    if font_size < drawable.min_font_size:
+        return None
+    return gene_name, font_size, gene_size, rotated
+
+
+def get_blocks(drawable: DrawableGenome) -> List[Tuple[Gene, bool]]:
+    # the genes to draw and whether they are labeled
+    genes = drawable.genome.genes
+    if drawable.detail < DETAIL_BLOCKS:
+        return [(gene, True) for gene in genes]
+    blocks = []
+    for color_key, run in groupby(genes, key=lambda gene: get_color_key(drawable.color_scheme, gene.name)):
+        run = list(run)
+        if color_key is None or len(run) == 1:
+            blocks.extend((gene, True) for gene in run)
+        else:
+            blocks.append((Gene(run[0].name, None, run[0].start, run[-1].end,
+                                sum(gene.scaled_length for gene in run)), False))
+    return blocks
+
+
+def get_orientation_runs(genes: Iterable[Gene]) -> Iterator[Tuple[str, int, int]]:
+    # strand, offset and length, in scaled units, of the runs of consecutive genes on the same strand
+    offset = 0
+    for orientation, run in groupby(genes, key=lambda gene: None if gene.name == 'intergenic' else gene.orientation):
+        length = sum(gene.scaled_length for gene in run)
+        if orientation is not None:
+            yield orientation, offset, length
+        offset += length
+
+
+def count_elements(drawable: DrawableGenome, circular: bool = False) -> int:
+    # the number of elements draw_genome or draw_circular_genome appends for the drawable
+    font_size = int(GENE_HEIGHT / 3.5) if circular else int(GENE_HEIGHT / 3)
+    blocks = get_blocks(drawable)
+    if circular:
+        # rings and species, one band and the arrow definitions or one black arc per gene
+        count = 6 if drawable.optimized else 4 + len(blocks)
+    else:
+        count = 1
+    count += sum(1 + (labeled and get_label(drawable, gene, font_size) is not None) for gene, labeled in blocks)
+    if drawable.oriented:
+        if drawable.detail >= DETAIL_ORIENTATIONS:
+            lengths = [length for _, _, length in get_orientation_runs(drawable.genome.genes)]
+        else:
+            lengths = [gene.scaled_length for gene in drawable.genome.genes if gene.name != 'intergenic']
+        count += sum(2 if length > 1 else 1 for length in lengths)
+    return count
+
+
+def count_detail_elements(drawable: DrawableGenome, circular: bool = False) -> List[int]:
+    # the number of elements of the drawable at each level of detail
+    return [count_elements(replace(drawable, detail=detail), circular) for detail in DETAILS]
+
+
+def get_detail(nb_elements: Sequence[int], max_elements: int) -> int:
+    # the most detailed level whose number of elements fits in max_elements
+    for detail, count in zip(DETAILS, nb_elements):
+        if count <= max_elements:
+            return detail
+    logging.warning(f'{nb_elements[-1]:,} elements at the lowest level of detail, more than the maximum of '
+                    f'{max_elements:,}')
+    return DETAIL_BLOCKS
+
+
+def set_detail(drawables: List[DrawableGenome], max_elements: int = None, circular: bool = False,
+               count: Callable[[DrawableGenome], int] = None):
+    if max_elements is None:
+        return
+    counts = []
+    for drawable in drawables:
+        # each drawable materialized once for all the levels
+        drawable = materialize(drawable)
+        if count is None:
+            counts.append(count_detail_elements(drawable, circular))
+        else:
+            counts.append([count(replace(drawable, detail=detail)) for detail in DETAILS])
+    nb_elements = [sum(detail_counts) for detail_counts in zip(*counts)]
+    detail = get_detail(nb_elements, max_elements)
+    for drawable in drawables:
+        drawable.detail = detail
 
-        txt_x = origin.x + ((gene.scaled_length * SCALE_FACTOR) + font_size * 0.7) / 2
-        txt_y = origin.y + (GENE_HEIGHT + gene_size) / 2
-        drawing.append(draw.Text(gene_name, font_size, txt_x, txt_y,
-                                 font_family=drawable.font,
-                                 transform=f'rotate(270, {txt_x}, {txt_y})'))
-
-    # draw orientation
-    if drawable.oriented and gene.name != 'intergenic':
-        orientation_color = get_color(drawable.color_scheme, gene.orientation)
-        origin_x = origin.x if gene.orientation == '+' else origin.x + SCALE_FACTOR
-        if gene.scaled_length > 1:
-            drawing.append(draw.Rectangle(origin_x, origin.y + GENE_HEIGHT + INTRA_GENOME_SPACE,
-                                          (gene.scaled_length - 1) * SCALE_FACTOR, ORIENTATION_HEIGHT,
-                                          fill=orientation_color))
-            origin_x += (gene.scaled_length - 1) * SCALE_FACTOR if gene.orientation == '+' else 0
-        # draw arrow
-        arrow_x = origin_x + SCALE_FACTOR if gene.orientation == '+' else origin_x - SCALE_FACTOR
-        drawing.append(draw.Lines(origin_x, origin.y + GENE_HEIGHT + INTRA_GENOME_SPACE,
-                                  arrow_x, origin.y + GENE_HEIGHT + INTRA_GENOME_SPACE + ORIENTATION_HEIGHT / 2,
-                                  origin_x, origin.y + GENE_HEIGHT + INTRA_GENOME_SPACE + ORIENTATION_HEIGHT,
-                                  close=False,
-                                  fill=orientation_color))
+
+# ----------------------------- LAYOUT -----------------------------#
+
+@dataclass
+class Box:
+    # a gene of a ribbon, outlined, or an orientation bar
+    x: float
+    y: float
+    width: float
+    height: float
+    name: str
+    outlined: bool = True
+
+
+@dataclass
+class Arc:
+    # a gene of a circle, or an orientation bar, between two angles in degrees
+    c_x: float
+    c_y: float
+    radius: float
+    start: float
+    end: float
+    name: str
+    bar: bool = False
+
+
+@dataclass
+class Band:
+    # a gene of a ring, outlined, or an orientation arrow, as an svg path
+    d: str
+    name: str
+    outlined: bool = True
+
+
+@dataclass
+class Frame:
+    # the inner and outer circles of a circular genome
+    c_x: float
+    c_y: float
+    r_in: float
+    r_out: float
+
+
+@dataclass
+class Arrow:
+    # the tip of an orientation, a rotation around the center of a circular genome
+    points: Tuple[float, float, float, float, float, float]
+    name: str
+    center: Tuple[float, float] = None
+    rotation: float = None
+
+
+@dataclass
+class Label:
+    # a gene or species name, rotated around its origin, centered on it or following a path
+    text: str
+    font_size: float
+    x: float = None
+    y: float = None
+    rotation: float = None
+    species: bool = False
+    centered: bool = False
+    path: str = None
+
+
+Shape = Union[Box, Arc, Band, Frame, Arrow, Label]
+
+
+@dataclass
+class Layout:
+    # the shapes of each genome, independent of the colors, the font and the css classes
+    width: float
+    height: float
+    drawables: List[DrawableGenome]
+    shapes: List[List[Shape]]
+
+    def to_dict(self) -> dict:
+        return {'width': self.width, 'height': self.height,
+                'genomes': [{'species': drawable.genome.species, 'length': drawable.genome.length,
+                             'detail': drawable.detail,
+                             'shapes': [{'type': type(shape).__name__.lower(), **asdict(shape)} for shape in shapes]}
+                            for drawable, shapes in zip(self.drawables, self.shapes)]}
+
+
+def render_shapes(drawable: DrawableGenome, shapes: Iterable[Shape], drawing: draw.Drawing) -> int:
+    # append the elements of the shapes styled by the drawable, returns the number of elements
+    nb_elements = 0
+    for shape in shapes:
+        if isinstance(shape, Label):
+            kwargs = {}
+            if shape.path is not None:
+                kwargs = {'path': draw.Path(d=shape.path), 'text_anchor': 'middle'}
+            elif shape.centered:
+                kwargs = {'text_anchor': 'middle', 'dominant_baseline': 'central'}
+            if shape.species:
+                kwargs.update(style(drawable, 'species', font_family=drawable.font, font_style='italic',
+                                    font_weight='bold'))
+            else:
+                kwargs.update(style(drawable, None, font_family=drawable.font))
+            if shape.rotation is not None:
+                kwargs['transform'] = f'rotate({shape.rotation}, {shape.x}, {shape.y})'
+            drawing.append(draw.Text(shape.text, shape.font_size, shape.x, shape.y, **kwargs))
+            nb_elements += 1
+            continue
+        if isinstance(shape, Frame):
+            for radius in (shape.r_in, shape.r_out):
+                drawing.append(draw.Circle(shape.c_x, shape.c_y, radius, **style(drawable, 'ring', fill='none',
+                                                                                  stroke_width=STROKE_WIDTH,
+                                                                                  stroke='black')))
+            nb_elements += 2
+            if drawable.optimized:
+                # the black arcs drawn under each gene form a single band, and the arrows only differ by a rotation
+                drawing.append(draw.Circle(shape.c_x, shape.c_y, (shape.r_in + shape.r_out) / 2, class_='band'))
+                drawing.append(get_circular_arrow_defs(shape.r_out))
+                nb_elements += 2
+            continue
+        color = get_color(drawable.color_scheme, shape.name)
+        css_class = get_css_class(drawable.color_scheme, shape.name)
+        if isinstance(shape, Box):
+            if shape.outlined:
+                drawing.append(draw.Rectangle(shape.x, shape.y, shape.width, shape.height,
+                                              **style(drawable, f'gene f-{css_class}', fill=color, stroke='black',
+                                                      stroke_width=STROKE_WIDTH)))
+            else:
+                drawing.append(draw.Rectangle(shape.x, shape.y, shape.width, shape.height,
+                                              **style(drawable, f'f-{css_class}', fill=color)))
+        elif isinstance(shape, Arc):
+            if shape.bar:
+                drawing.append(draw.ArcLine(shape.c_x, shape.c_y, shape.radius, shape.start, shape.end,
+                                            **style(drawable, f'bar s-{css_class}', stroke=color,
+                                                    stroke_width=ORIENTATION_HEIGHT / 2, fill='none',
+                                                    fill_opacity=0.0)))
+            else:
+                if not drawable.optimized:
+                    drawing.append(draw.ArcLine(shape.c_x, shape.c_y, shape.radius, shape.start, shape.end,
+                                                stroke='black', stroke_width=RIBBON_HEIGHT / 2 - STROKE_WIDTH,
+                                                fill='none', fill_opacity=0.0))
+                    nb_elements += 1
+                drawing.append(draw.ArcLine(shape.c_x, shape.c_y, shape.radius, shape.start + 0.15, shape.end - 0.15,
+                                            **style(drawable, f'arc s-{css_class}', stroke=color,
+                                                    stroke_width=RIBBON_HEIGHT / 2 - STROKE_WIDTH, fill='none',
+                                                    fill_opacity=0.0)))
+        elif isinstance(shape, Band):
+            if shape.outlined:
+                drawing.append(draw.Path(d=shape.d, **style(drawable, f'gene f-{css_class}', fill=color,
+                                                            stroke='black', stroke_width=STROKE_WIDTH)))
+            else:
+                drawing.append(draw.Path(d=shape.d, **style(drawable, f'f-{css_class}', fill=color)))
+        elif isinstance(shape, Arrow):
+            if not drawable.optimized:
+                drawing.append(draw.Lines(*shape.points, close=False, fill=color))
+            elif shape.center is None:
+                # a reference to the arrow defined once in optimized mode
+                arrow_id = 'arrow-plus' if shape.name == '+' else 'arrow-minus'
+                drawing.append(draw.Use(arrow_id, shape.points[0], shape.points[1], class_=f'f-{css_class}'))
+            else:
+                arrow_id = 'carrow-plus' if shape.name == '+' else 'carrow-minus'
+                drawing.append(draw.Use(arrow_id, 0, 0, class_=f'f-{css_class}',
+                                        transform=f'translate({shape.center[0]},{shape.center[1]}) '
+                                                  f'rotate({shape.rotation})'))
+        nb_elements += 1
+    return nb_elements
+
+
+def get_layout(genomes: List[MtGenome], options: RenderOptions) -> Layout:
+    # ribbons, a circle for a single circular genome or concentric rings for several
+    drawables = [get_drawable(genome, i, options) for i, genome in enumerate(genomes)]
+    if options.circular and len(drawables) > 1:
+        r_0 = get_concentric_radius(drawables)
+        set_detail(drawables, options.max_elements, count=lambda drawable: count_ring_elements(drawable, r_0))
+        width = height = 2 * (r_0 + INTER_GENOME_SPACE)
+        layout_figure_genome = partial(layout_ring, r_0=r_0, c_x=width / 2, c_y=height / 2)
+    elif options.circular:
+        set_detail(drawables, options.max_elements, circular=True)
+        width, height = get_figure_size(drawables, circular=True)
+        layout_figure_genome = partial(layout_circular_genome, c_x=width / 2, c_y=height / 2)
+    else:
+        set_detail(drawables, options.max_elements)
+        width, height = get_figure_size(drawables)
+        layout_figure_genome = layout_genome
+    shapes = []
+    for drawable in drawables:
+        # the genes of a compact genome only exist during its layout, the shapes are kept
+        with profile_stage('layout', drawable.genome.species):
+            shapes.append(layout_figure_genome(materialize(drawable)))
+    return Layout(width, height, drawables, shapes)
+
+
+def get_layout_key(options: RenderOptions) -> tuple:
+    # the options changing the layout, the colors and the css classes also change the level of detail
+    key = (options.circular, options.full_name, options.oriented, options.max_elements, options.zoom)
+    return key + ((options.monochromatic, options.optimize) if options.max_elements is not None else ())
+
+
+def render_layout(layout: Layout, options: RenderOptions, output: Union[str, TextIO]):
+    color_scheme = COLOR_SCHEMES['monochromatic'] if options.monochromatic else COLOR_SCHEMES['default']
+    drawing = draw.Drawing(layout.width, layout.height)
+    target = drawing if options.precision is None else PrecisionDrawing(drawing, options.precision)
+    if options.optimize:
+        drawing.append(get_optimized_defs(color_scheme, options.font))
+    for drawable, shapes in zip(layout.drawables, layout.shapes):
+        drawable = replace(drawable, color_scheme=color_scheme, font=options.font, optimized=options.optimize)
+        with profile_stage('draw', drawable.genome.species) as stage:
+            nb_elements = render_shapes(drawable, shapes, target)
+        if stage is not None:
+            stage.add(elements=nb_elements)
+    drawing.set_pixel_scale(PIXEL_SCALE)
+    write_drawing(drawing, output)
+
+
+def write_layout(layout: Layout, output: Union[str, TextIO]):
+    with profile_stage('write', output if isinstance(output, str) else None) as stage:
+        with open_output(output) as f:
+            json.dump(layout.to_dict(), f)
+    if stage is not None and isinstance(output, str):
+        stage.add(bytes=os.path.getsize(output))
+
+
+def render_figures(genomes: List[MtGenome], outputs: List[Tuple[RenderOptions, Union[str, TextIO]]]):
+    # one layout per distinct set of layout options, rendered to each output sharing it, .json paths get the layout
+    # and .html paths the viewer
+    layouts = {}
+    for options, output in outputs:
+        if isinstance(output, str) and output.endswith('.html'):
+            write_viewer(genomes, options, output)
+            continue
+        key = get_layout_key(options)
+        if key not in layouts:
+            layouts[key] = get_layout(genomes, options)
+        if isinstance(output, str) and output.endswith('.json'):
+            write_layout(layouts[key], output)
+        else:
+            render_layout(layouts[key], options, output)
+
+
+#----------------------------- RIBBON -----------------------------#
+
+def in_window(drawable: DrawableGenome, x_from: float, x_to: float) -> bool:
+    return drawable.window is None or (x_from < drawable.window[1] and x_to > drawable.window[0])
+
+
+def layout_genome(drawable: DrawableGenome) -> List[Shape]:
+    # species
+    shapes = []
+    species_font_size = SPECIES_HEIGHT * 0.75
+    species = drawable.genome.species + f' ({drawable.genome.length:,} bp)'
+    if in_window(drawable, drawable.origin.x, drawable.origin.x + len(species) * species_font_size / 2):
+        shapes.append(Label(species, species_font_size, drawable.origin.x, drawable.origin.y + species_font_size,
+                            species=True))
+    # genes, x offsets are the cumulative sum of the scaled lengths
+    blocks = get_blocks(drawable)
+    gene_xs = list(accumulate((gene.scaled_length * SCALE_FACTOR for gene, _ in blocks),
+                              initial=drawable.origin.x + STROKE_WIDTH))
+    first, last = 0, len(blocks)
+    if drawable.window is not None:
+        # only the genes intersecting the window
+        first = max(0, bisect_right(gene_xs, drawable.window[0]) - 1)
+        last = min(last, bisect_left(gene_xs, drawable.window[1]))
+    for i in range(first, last):
+        gene, labeled = blocks[i]
+        layout_gene(drawable, gene, Point(gene_xs[i], drawable.origin.y + SPECIES_HEIGHT), shapes, labeled)
+    # a single orientation per run of genes on the same strand
+    if drawable.oriented and drawable.detail >= DETAIL_ORIENTATIONS:
+        for orientation, offset, length in get_orientation_runs(drawable.genome.genes):
+            run_x = drawable.origin.x + STROKE_WIDTH + offset * SCALE_FACTOR
+            if in_window(drawable, run_x, run_x + length * SCALE_FACTOR):
+                layout_orientation(orientation, length, Point(run_x, drawable.origin.y + SPECIES_HEIGHT), shapes)
+    return shapes
+
+
+def layout_gene(drawable: DrawableGenome, gene: Gene, origin: Point, shapes: List[Shape],
+                labeled: bool = True) -> Point:
+    # gene
+    shapes.append(Box(origin.x, origin.y, gene.scaled_length * SCALE_FACTOR, GENE_HEIGHT, gene.name))
+
+    # gene name, unless dropped by the level of detail
+    label = get_label(drawable, gene, int(GENE_HEIGHT / 3)) if labeled else None
+    if label is not None:
+        gene_name, font_size, gene_size, rotated = label
+        if not rotated:
+            shapes.append(Label(gene_name, font_size,
+                                origin.x + ((gene.scaled_length * SCALE_FACTOR) - gene_size) / 2,
+                                origin.y + (GENE_HEIGHT + font_size * 0.75) / 2))
+        else:
+            txt_x = origin.x + ((gene.scaled_length * SCALE_FACTOR) + font_size * 0.7) / 2
+            txt_y = origin.y + (GENE_HEIGHT + gene_size) / 2
+            shapes.append(Label(gene_name, font_size, txt_x, txt_y, rotation=270))
+
+    # orientation, once per run of genes by layout_genome at lower levels of detail
+    if drawable.oriented and gene.name != 'intergenic' and drawable.detail < DETAIL_ORIENTATIONS:
+        layout_orientation(gene.orientation, gene.scaled_length, origin, shapes)
     return Point(origin.x + gene.scaled_length * SCALE_FACTOR, origin.y)
 
 
-def draw_ribbons(genomes: List[MtGenome], output: str,
+def layout_orientation(orientation: str, scaled_length: int, origin: Point, shapes: List[Shape]):
+    origin_x = origin.x if orientation == '+' else origin.x + SCALE_FACTOR
+    if scaled_length > 1:
+        shapes.append(Box(origin_x, origin.y + GENE_HEIGHT + INTRA_GENOME_SPACE,
+                          (scaled_length - 1) * SCALE_FACTOR, ORIENTATION_HEIGHT, orientation, outlined=False))
+        origin_x += (scaled_length - 1) * SCALE_FACTOR if orientation == '+' else 0
+    # arrow
+    arrow_x = origin_x + SCALE_FACTOR if orientation == '+' else origin_x - SCALE_FACTOR
+    shapes.append(Arrow((origin_x, origin.y + GENE_HEIGHT + INTRA_GENOME_SPACE,
+                         arrow_x, origin.y + GENE_HEIGHT + INTRA_GENOME_SPACE + ORIENTATION_HEIGHT / 2,
+                         origin_x, origin.y + GENE_HEIGHT + INTRA_GENOME_SPACE + ORIENTATION_HEIGHT),
+                        orientation))
+
+
+def draw_genome(drawable: DrawableGenome, drawing: draw.Drawing):
+    render_shapes(drawable, layout_genome(drawable), drawing)
+
+
+def draw_ribbons(genomes: List[MtGenome], output: Union[str, TextIO],
                  monochromatic: bool = False,
                  font: str = 'Arial',
                  full_name: bool = False,
-                 oriented: bool = False):
-    drawables, color_scheme = [], COLOR_SCHEMES['monochromatic'] if monochromatic else COLOR_SCHEMES['default']
-    for i in range(len(genomes)):
-        drawables.append(DrawableGenome(Point(0, i * RIBBON_HEIGHT),
-                                        color_scheme, font, full_name, oriented,
-                                        genomes[i]))
-    drawing = get_drawing(drawables)
-    for drawable in drawables:
-        draw_genome(drawable, drawing)
-    drawing.set_pixel_scale(PIXEL_SCALE)
-    drawing.save_svg(output)
+                 oriented: bool = False,
+                 optimized: bool = False,
+                 precision: int = None,
+                 max_elements: int = None,
+                 zoom: float = None):
+    options = RenderOptions(monochromatic=monochromatic, font=font, full_name=full_name, oriented=oriented,
+                            optimize=optimized, precision=precision, max_elements=max_elements, zoom=zoom)
+    render_layout(get_layout(genomes, options), options, output)
 
 
 # ----------------------------- CIRCLE -----------------------------#
@@ -384,110 +1761,1281 @@ def x_to_polar(x: float, radius: float) -> Tuple[float, float]:
     return angle, radius * cos(angle), radius * sin(angle)
 
 
-def draw_circular_genome(drawable: DrawableGenome, drawing: draw.Drawing):
-    # draw inner and outer circles
-    c_x, c_y = drawing.width / 2, drawing.height / 2
+def layout_circular_genome(drawable: DrawableGenome, c_x: float, c_y: float) -> List[Shape]:
+    # inner and outer circles
     r_out = (drawable.genome.get_scaled_length() * SCALE_FACTOR) / (pi * 2)
     r_in = r_out - RIBBON_HEIGHT / 2
-    drawing.append(draw.Circle(c_x, c_y, r_in, fill='none', stroke_width=STROKE_WIDTH, stroke='black'))
-    drawing.append(draw.Circle(c_x, c_y, r_out, fill='none', stroke_width=STROKE_WIDTH, stroke='black'))
-    # draw species name
+    shapes = [Frame(c_x, c_y, r_in, r_out)]
+    # species name
     species_font_size = SPECIES_HEIGHT * 0.75
     sp_name, sp_length = drawable.genome.species, f'({drawable.genome.length:,} bp)'
-    drawing.append(draw.Text(sp_name, species_font_size,
-                             c_x - (len(sp_name) * species_font_size / 2) / 2, c_y - (species_font_size * 0.7) / 2,
-                             font_family=drawable.font, font_style='italic', font_weight='bold'))
-    drawing.append(draw.Text(sp_length, species_font_size,
-                             c_x - (len(sp_length) * species_font_size / 2) / 2, c_y + (species_font_size * 0.7),
-                             font_family=drawable.font, font_style='italic', font_weight='bold'))
-    # draw genes
+    shapes.append(Label(sp_name, species_font_size,
+                        c_x - (len(sp_name) * species_font_size / 2) / 2, c_y - (species_font_size * 0.7) / 2,
+                        species=True))
+    shapes.append(Label(sp_length, species_font_size,
+                        c_x - (len(sp_length) * species_font_size / 2) / 2, c_y + (species_font_size * 0.7),
+                        species=True))
+    # genes
     x_pos = 0
-    for gene in drawable.genome.genes:
-        x_pos = draw_circular_gene(drawable, gene, c_x, c_y, x_pos, r_in, r_out, drawing)
-
-        
-def draw_circular_gene(drawable: DrawableGenome, gene: Gene, c_x: float, c_y: float, 
-                       x_pos: float, r_in: float, r_out: float, drawing: draw.Drawing) -> float:
-    # draw gene arcs
+    for gene, labeled in get_blocks(drawable):
+        x_pos = layout_circular_gene(drawable, gene, c_x, c_y, x_pos, r_in, r_out, shapes, labeled)
+    # a single orientation per run of genes on the same strand
+    if drawable.oriented and drawable.detail >= DETAIL_ORIENTATIONS:
+        for orientation, offset, length in get_orientation_runs(drawable.genome.genes):
+            layout_circular_orientation(orientation, length, c_x, c_y, offset * SCALE_FACTOR, r_out, shapes)
+    return shapes
+
+
+def layout_circular_gene(drawable: DrawableGenome, gene: Gene, c_x: float, c_y: float,
+                         x_pos: float, r_in: float, r_out: float, shapes: List[Shape],
+                         labeled: bool = True) -> float:
+    # gene arc
     angle_from = x_to_deg(x_pos, r_out)
     angle_to = x_to_deg(x_pos + gene.scaled_length * SCALE_FACTOR, r_out)
-    drawing.append(draw.ArcLine(c_x, c_y, (r_in + r_out) / 2, angle_to, angle_from,
-        stroke='black', stroke_width=RIBBON_HEIGHT/2 - STROKE_WIDTH, fill='none', fill_opacity=0.0))
-    drawing.append(draw.ArcLine(c_x, c_y, (r_in + r_out) / 2, angle_to + 0.15, angle_from - 0.15,
-        stroke=get_color(drawable.color_scheme, gene.name), stroke_width=RIBBON_HEIGHT/2 - STROKE_WIDTH, fill='none', fill_opacity=0.0))
-
-    # draw gene name
-    gene_name = gene.name if drawable.full_name else get_clean_name(gene.name)
-    font_size = int(GENE_HEIGHT / 3.5)
-    gene_size = len(gene_name) * font_size / 2
+    shapes.append(Arc(c_x, c_y, (r_in + r_out) / 2, angle_to, angle_from, gene.name))
+
+    # gene name, unless dropped by the level of detail
+    label = get_label(drawable, gene, int(GENE_HEIGHT / 3.5)) if labeled else None
+    if label is not None:
+        gene_name, font_size, gene_size, rotated = label
+        if not rotated:
+            angle, origin_x, origin_y = x_to_polar(x_pos + ((gene.scaled_length * SCALE_FACTOR) - gene_size) / 2, r_out)
+            text_rotation = int((angle + pi/1.9) * (180/pi))
+            text_x, text_y = RADIUS_RATIO * origin_x + c_x, RADIUS_RATIO * origin_y + c_y
+            shapes.append(Label(gene_name, font_size, text_x, text_y, rotation=text_rotation))
+        else:
+            angle, origin_x, origin_y = x_to_polar(x_pos + ((gene.scaled_length * SCALE_FACTOR) + font_size * 0.7) / 2, r_out)
+            text_x, text_y = (RADIUS_RATIO - .03) * origin_x + c_x, (RADIUS_RATIO - .03) * origin_y + c_y
+            text_rotation = int(angle * (180/pi))
+            shapes.append(Label(gene_name, font_size, text_x, text_y, rotation=text_rotation))
 
-    if gene_size < gene.scaled_length * SCALE_FACTOR:
-        angle, origin_x, origin_y = x_to_polar(x_pos + ((gene.scaled_length * SCALE_FACTOR) - gene_size) / 2, r_out)
-        text_rotation = int((angle + pi/1.9) * (180/pi))
-        text_x, text_y = RADIUS_RATIO * origin_x + c_x, RADIUS_RATIO * origin_y + c_y
-        drawing.append(draw.Text(gene_name, font_size,text_x, text_y, font_family=drawable.font, 
-                                 transform=f'rotate({text_rotation}, {text_x}, {text_y})'))   
-    else:
-        if gene_size > GENE_HEIGHT:
-            font_size = int(2 * GENE_HEIGHT / len(gene_name))
-            gene_size = len(gene_name) * font_size / 2
+    # orientation, once per run of genes by layout_circular_genome at lower levels of detail
+    if drawable.oriented and gene.name != 'intergenic' and drawable.detail < DETAIL_ORIENTATIONS:
+        layout_circular_orientation(gene.orientation, gene.scaled_length, c_x, c_y, x_pos, r_out, shapes)
 
-        angle, origin_x, origin_y = x_to_polar(x_pos + ((gene.scaled_length * SCALE_FACTOR) + font_size * 0.7) / 2, r_out)
-        text_x, text_y = (RADIUS_RATIO - .03) * origin_x + c_x, (RADIUS_RATIO - .03) * origin_y + c_y
-        text_rotation = int(angle * (180/pi))
-        drawing.append(draw.Text(gene_name, font_size,text_x, text_y, font_family=drawable.font, 
-                                 transform=f'rotate({text_rotation}, {text_x}, {text_y})'))
-
-    # draw orientation
-    if drawable.oriented and gene.name != 'intergenic':
-        orientation_color = get_color(drawable.color_scheme, gene.orientation)
-        origin_x = x_pos if gene.orientation == '+' else x_pos + SCALE_FACTOR
-        angle_from = x_to_deg(origin_x, r_out)
-        angle_to = x_to_deg(origin_x + (gene.scaled_length - 1) * SCALE_FACTOR, r_out)
-        r_orientation = r_out - RIBBON_HEIGHT/1.8
-
-        if gene.scaled_length > 1:
-            drawing.append(draw.ArcLine(c_x, c_y, r_orientation, angle_to, angle_from, 
-                                        stroke=orientation_color, stroke_width=ORIENTATION_HEIGHT / 2, 
-                                        fill='none', fill_opacity=0.0))
-            origin_x += (gene.scaled_length - 1) * SCALE_FACTOR if gene.orientation == '+' else 0
-
-        # draw arrow
-        arrow_x = origin_x + SCALE_FACTOR if gene.orientation == '+' else origin_x - SCALE_FACTOR
-        _, x_1, y_1 = x_to_polar(origin_x, r_out)
-        _, x_2, y_2 = x_to_polar(arrow_x, r_out)
-        _, x_3, y_3 = x_to_polar(origin_x, r_out)
-        ratio_1 = (r_orientation + ORIENTATION_HEIGHT / 2) / r_out
-        ratio_2 = r_orientation / r_out
-        ratio_3 = (r_orientation - ORIENTATION_HEIGHT / 2) / r_out
-        drawing.append(draw.Lines(x_1 * ratio_1 + c_x, y_1 * ratio_1 + c_y, 
-                                  x_2 * ratio_2 + c_x, y_2 * ratio_2  + c_y, 
-                                  x_3 * ratio_3 + c_x, y_3 * ratio_3 + c_y, 
-                                  close=False, fill=orientation_color))
- 
     return x_pos + gene.scaled_length * SCALE_FACTOR
-    
 
-def draw_circle(genomes: List[MtGenome], output: str,
+
+def layout_circular_orientation(orientation: str, scaled_length: int, c_x: float, c_y: float,
+                                x_pos: float, r_out: float, shapes: List[Shape]):
+    origin_x = x_pos if orientation == '+' else x_pos + SCALE_FACTOR
+    angle_from = x_to_deg(origin_x, r_out)
+    angle_to = x_to_deg(origin_x + (scaled_length - 1) * SCALE_FACTOR, r_out)
+    r_orientation = r_out - RIBBON_HEIGHT/1.8
+
+    if scaled_length > 1:
+        shapes.append(Arc(c_x, c_y, r_orientation, angle_to, angle_from, orientation, bar=True))
+        origin_x += (scaled_length - 1) * SCALE_FACTOR if orientation == '+' else 0
+
+    # arrow, also a rotation of the arrow defined once in optimized mode
+    arrow_x = origin_x + SCALE_FACTOR if orientation == '+' else origin_x - SCALE_FACTOR
+    _, x_1, y_1 = x_to_polar(origin_x, r_out)
+    _, x_2, y_2 = x_to_polar(arrow_x, r_out)
+    _, x_3, y_3 = x_to_polar(origin_x, r_out)
+    ratio_1 = (r_orientation + ORIENTATION_HEIGHT / 2) / r_out
+    ratio_2 = r_orientation / r_out
+    ratio_3 = (r_orientation - ORIENTATION_HEIGHT / 2) / r_out
+    shapes.append(Arrow((x_1 * ratio_1 + c_x, y_1 * ratio_1 + c_y,
+                         x_2 * ratio_2 + c_x, y_2 * ratio_2 + c_y,
+                         x_3 * ratio_3 + c_x, y_3 * ratio_3 + c_y),
+                        orientation, (c_x, c_y), origin_x / r_out * 180 / pi))
+
+
+def draw_circular_genome(drawable: DrawableGenome, drawing: draw.Drawing):
+    render_shapes(drawable, layout_circular_genome(drawable, drawing.width / 2, drawing.height / 2), drawing)
+
+
+def get_circular_arrow_defs(r_out: float) -> draw.Raw:
+    # arrows of the gene starting at x = 0, centered on the origin
+    r_orientation = r_out - RIBBON_HEIGHT/1.8
+    ratios = ((r_orientation + ORIENTATION_HEIGHT / 2) / r_out, r_orientation / r_out,
+              (r_orientation - ORIENTATION_HEIGHT / 2) / r_out)
+    paths = []
+    for orientation, arrow_x in (('plus', SCALE_FACTOR), ('minus', -SCALE_FACTOR)):
+        (_, x_1, y_1), (_, x_2, y_2) = x_to_polar(0, r_out), x_to_polar(arrow_x, r_out)
+        paths.append(f'<path id="carrow-{orientation}" d="M{x_1 * ratios[0]},{y_1 * ratios[0]}'
+                     f'L{x_2 * ratios[1]},{y_2 * ratios[1]}L{x_1 * ratios[2]},{y_1 * ratios[2]}"/>')
+    return draw.Raw(f'<defs>{"".join(paths)}</defs>')
+
+
+def draw_circle(genomes: List[MtGenome], output: Union[str, TextIO],
                  monochromatic: bool = False,
                  font: str = 'Arial',
-                 full_name: bool = False, 
-                 oriented: bool = False):
-    
-    color_scheme = COLOR_SCHEMES['monochromatic'] if monochromatic else COLOR_SCHEMES['default']
-    drawable = DrawableGenome(Point(0, 0), color_scheme, font, full_name, oriented, genomes[0])
-    drawing = get_drawing([drawable], circular=True)
-    draw_circular_genome(drawable, drawing)
+                 full_name: bool = False,
+                 oriented: bool = False,
+                 optimized: bool = False,
+                 precision: int = None,
+                 max_elements: int = None,
+                 zoom: float = None):
+    # a circle for a single genome, concentric rings for several
+    options = RenderOptions(circular=True, monochromatic=monochromatic, font=font, full_name=full_name,
+                            oriented=oriented, optimize=optimized, precision=precision, max_elements=max_elements,
+                            zoom=zoom)
+    render_layout(get_layout(genomes, options), options, output)
+
+
+# ----------------------------- CONCENTRIC -----------------------------#
+
+CONCENTRIC_INNER_RADIUS = 2 * RIBBON_HEIGHT  # radius of the empty disc inside the innermost ring
+RING_DECIMALS = 2                            # decimals of the ring coordinates, far below a pixel
+
+
+def get_concentric_radius(drawables: List[DrawableGenome]) -> int:
+    # outer radius of the first ring, the longest genome keeps the scale of the ribbons
+    length = max(drawable.genome.get_scaled_length() for drawable in drawables)
+    return ceil(max(length * SCALE_FACTOR / (2 * pi), len(drawables) * RIBBON_HEIGHT + CONCENTRIC_INNER_RADIUS))
+
+
+def get_ring_radii(drawable: DrawableGenome, r_0: float) -> Tuple[float, float, float, float]:
+    # species baseline, outer and inner gene radii and orientation middle of the ring, a ribbon bent into a circle
+    r_top = r_0 - drawable.origin.y
+    r_gene = r_top - SPECIES_HEIGHT
+    return (r_top - SPECIES_HEIGHT * 0.75, r_gene, r_gene - GENE_HEIGHT,
+            r_gene - GENE_HEIGHT - INTRA_GENOME_SPACE - ORIENTATION_HEIGHT / 2)
+
+
+def get_ring_layout(lengths: Sequence[int]) -> Tuple[float, array, array, array]:
+    # angle of one scaled unit, then the angles, clockwise from 12 o'clock, of the gene boundaries at even
+    # indices and of the gene middles at odd indices, with their sines and cosines computed in one pass
+    unit, x, angles = 2 * pi / sum(lengths), 0, array('d', [0.0])
+    for length in lengths:
+        angles.append((x + length / 2) * unit)
+        x += length
+        angles.append(x * unit)
+    return unit, angles, array('d', map(sin, angles)), array('d', map(cos, angles))
+
+
+def get_arrow_layout(segments: Sequence[Tuple[str, int, int]], unit: float) -> Tuple[array, array]:
+    # sines and cosines of the tip, then of the start, middle and end of the bar, of each orientation segment
+    angles = array('d')
+    for orientation, offset, length in segments:
+        if orientation == '+':
+            angles.extend((offset + length, offset, offset + (length - 1) / 2, offset + length - 1))
+        else:
+            angles.extend((offset, offset + 1, offset + (length + 1) / 2, offset + length))
+    angles = array('d', (angle * unit for angle in angles))
+    return array('d', map(sin, angles)), array('d', map(cos, angles))
+
+
+def get_ring_point(c_x: float, c_y: float, radius: float, s: float, c: float) -> str:
+    return f'{round(c_x + radius * s, RING_DECIMALS)},{round(c_y - radius * c, RING_DECIMALS)}'
+
+
+def get_band_path(c_x: float, c_y: float, r_out: float, r_in: float, trig: Sequence[Tuple[float, float]],
+                  tip: str = None, forward: bool = True) -> str:
+    # closed path of the band between r_out and r_in through the (sine, cosine) of its angles, clockwise, with an
+    # arrow tip at its end when forward, at its start otherwise
+    outer = [get_ring_point(c_x, c_y, r_out, s, c) for s, c in trig]
+    inner = [get_ring_point(c_x, c_y, r_in, s, c) for s, c in trig]
+    path = 'M' + outer[0] + ''.join(f'A{r_out},{r_out} 0 0 1 {point}' for point in outer[1:])
+    if tip is not None and forward:
+        path += 'L' + tip
+    path += 'L' + inner[-1] + ''.join(f'A{r_in},{r_in} 0 0 0 {point}' for point in reversed(inner[:-1]))
+    if tip is not None and not forward:
+        path += 'L' + tip
+    return path + 'Z'
+
+
+def get_ring_label(drawable: DrawableGenome, gene: Gene, unit: float,
+                   r_label: float) -> Optional[Tuple[str, int, float, bool]]:
+    return get_label(drawable, gene, int(GENE_HEIGHT / 3), gene.scaled_length * unit * r_label)
+
+
+def count_ring_elements(drawable: DrawableGenome, r_0: float) -> int:
+    # the number of elements of the shapes of layout_ring for the drawable
+    blocks = get_blocks(drawable)
+    unit = 2 * pi / sum(gene.scaled_length for gene, _ in blocks)
+    _, r_gene, _, _ = get_ring_radii(drawable, r_0)
+    count = 1 + sum(1 + (labeled and get_ring_label(drawable, gene, unit, r_gene - GENE_HEIGHT / 2) is not None)
+                    for gene, labeled in blocks)
+    if drawable.oriented:
+        if drawable.detail >= DETAIL_ORIENTATIONS:
+            count += sum(1 for _ in get_orientation_runs(drawable.genome.genes))
+        else:
+            count += sum(1 for gene in drawable.genome.genes if gene.name != 'intergenic')
+    return count
+
+
+def layout_ring(drawable: DrawableGenome, r_0: float, c_x: float, c_y: float) -> List[Shape]:
+    r_species, r_out, r_in, r_orientation = get_ring_radii(drawable, r_0)
+    # species name along the top of the ring
+    species = drawable.genome.species + f' ({drawable.genome.length:,} bp)'
+    shapes = [Label(species, SPECIES_HEIGHT * 0.75, species=True,
+                    path=f'M{c_x - r_species},{c_y}A{r_species},{r_species} 0 0 1 {c_x + r_species},{c_y}')]
+    # each gene as a single annular sector, split in two arcs when longer than half the ring
+    blocks = get_blocks(drawable)
+    unit, angles, sins, coss = get_ring_layout([gene.scaled_length for gene, _ in blocks])
+    r_label = r_out - GENE_HEIGHT / 2
+    for i, (gene, labeled) in enumerate(blocks):
+        k = 2 * i
+        indices = (k, k + 1, k + 2) if angles[k + 2] - angles[k] > pi else (k, k + 2)
+        shapes.append(Band(get_band_path(c_x, c_y, r_out, r_in, [(sins[j], coss[j]) for j in indices]), gene.name))
+        # gene name at the middle of the gene, tangent when it fits, radial otherwise, never upside down
+        label = get_ring_label(drawable, gene, unit, r_label) if labeled else None
+        if label is not None:
+            gene_name, font_size, _, rotated = label
+            text_x = round(c_x + r_label * sins[k + 1], RING_DECIMALS)
+            text_y = round(c_y - r_label * coss[k + 1], RING_DECIMALS)
+            rotation = round(angles[k + 1] * 180 / pi, RING_DECIMALS)
+            if rotated:
+                rotation += -90 if rotation <= 180 else 90
+            elif 90 < rotation < 270:
+                rotation -= 180
+            shapes.append(Label(gene_name, font_size, text_x, text_y, rotation, centered=True))
+    # each orientation as a single arrow shaped path
+    if drawable.oriented:
+        if drawable.detail >= DETAIL_ORIENTATIONS:
+            segments = list(get_orientation_runs(drawable.genome.genes))
+        else:
+            segments = [(gene.orientation, offset, gene.scaled_length)
+                        for gene, offset in zip(drawable.genome.genes,
+                                                accumulate((gene.scaled_length for gene in drawable.genome.genes),
+                                                           initial=0))
+                        if gene.name != 'intergenic']
+        sins, coss = get_arrow_layout(segments, unit)
+        r_bar_out, r_bar_in = r_orientation + ORIENTATION_HEIGHT / 2, r_orientation - ORIENTATION_HEIGHT / 2
+        for i, (orientation, _, length) in enumerate(segments):
+            k = 4 * i
+            tip = get_ring_point(c_x, c_y, r_orientation, sins[k], coss[k])
+            indices = (k + 1, k + 2, k + 3) if (length - 1) * unit > pi else (k + 1, k + 3) if length > 1 else (k + 1,)
+            shapes.append(Band(get_band_path(c_x, c_y, r_bar_out, r_bar_in, [(sins[j], coss[j]) for j in indices],
+                                             tip, orientation == '+'),
+                               orientation, outlined=False))
+    return shapes
+
+
+# ----------------------------- VIEWER -----------------------------#
+
+VIEWER_MIN_FONT_SIZE = 4  # in screen pixels, smaller names are not drawn by the viewer
+
+# self-contained page, the genomes are read from the json of the data script and only the ribbons and genes in the
+# viewport are drawn on a canvas
+VIEWER_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>mtSVG</title>
+<style>
+html,body{margin:0;height:100%;overflow:hidden;font-family:sans-serif;font-size:14px}
+#bar{position:fixed;top:0;left:0;right:0;height:32px;box-sizing:border-box;padding:4px 8px;background:#f4f4f4;
+border-bottom:1px solid #ccc}
+#view{position:fixed;top:32px;left:0;cursor:grab}
+</style>
+</head>
+<body>
+<div id="bar"><input id="search" size="30" placeholder="species or gene, Enter for the next one">
+<span id="status"></span></div>
+<canvas id="view"></canvas>
+<script id="data" type="application/json">__DATA__</script>
+<script>
+const data = JSON.parse(document.getElementById('data').textContent);
+const g = data.geometry;
+const canvas = document.getElementById('view'), ctx = canvas.getContext('2d');
+const search = document.getElementById('search'), status = document.getElementById('status');
+const nbGenomes = data.species.length, nbGenes = data.gene_names.length;
+
+// x of each gene in its ribbon, the cumulative sum of the scaled lengths
+const xs = new Float64Array(nbGenes);
+let figureWidth = 0;
+for (let i = 0; i < nbGenomes; i++) {
+  let x = g.stroke_width;
+  for (let j = data.offsets[i]; j < data.offsets[i + 1]; j++) {
+    xs[j] = x;
+    x += data.gene_lengths[j] * g.scale_factor;
+  }
+  figureWidth = Math.max(figureWidth, x + g.stroke_width);
+}
+
+let view = {x: 0, y: 0, scale: 1}, width = 0, height = 0, pending = false;
+let geneMatches = null, genomeMatches = null, matches = [], current = -1;
+
+function fit() {
+  view = {x: 0, y: 0, scale: width / figureWidth};
+  redraw();
+}
+
+function resize() {
+  const ratio = window.devicePixelRatio || 1;
+  width = window.innerWidth;
+  height = window.innerHeight - 32;
+  canvas.width = width * ratio;
+  canvas.height = height * ratio;
+  canvas.style.width = width + 'px';
+  canvas.style.height = height + 'px';
+  ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+}
+
+function redraw() {
+  if (!pending) {
+    pending = true;
+    requestAnimationFrame(() => { pending = false; draw(); });
+  }
+}
+
+function label(text, fontSize, x, y, rotated, species) {
+  if (fontSize * view.scale < __MIN_FONT_SIZE__) return;
+  ctx.save();
+  ctx.font = (species ? 'italic bold ' : '') + fontSize + 'px ' + data.font;
+  ctx.fillStyle = 'black';
+  ctx.translate(x, y);
+  if (rotated) ctx.rotate(-Math.PI / 2);
+  ctx.fillText(text, 0, 0);
+  ctx.restore();
+}
+
+function orientation(strand, scaledLength, x, y) {
+  // a bar and an arrow, as in layout_orientation
+  let originX = strand === '+' ? x : x + g.scale_factor;
+  y += g.gene_height + g.intra_genome_space;
+  ctx.fillStyle = data.strand_colors[strand];
+  if (scaledLength > 1) {
+    ctx.fillRect(originX, y, (scaledLength - 1) * g.scale_factor, g.orientation_height);
+    if (strand === '+') originX += (scaledLength - 1) * g.scale_factor;
+  }
+  const arrowX = strand === '+' ? originX + g.scale_factor : originX - g.scale_factor;
+  ctx.beginPath();
+  ctx.moveTo(originX, y);
+  ctx.lineTo(arrowX, y + g.orientation_height / 2);
+  ctx.lineTo(originX, y + g.orientation_height);
+  ctx.fill();
+}
+
+function drawGenome(i, left, right) {
+  const y = i * g.ribbon_height;
+  const searched = genomeMatches !== null;
+  const speciesFontSize = g.species_height * 0.75;
+  ctx.globalAlpha = searched && !genomeMatches[i] ? 0.25 : 1;
+  label(data.species[i] + ' (' + data.lengths[i].toLocaleString('en-US') + ' bp)', speciesFontSize,
+        0, y + speciesFontSize, false, true);
+  const geneY = y + g.species_height;
+  for (let j = data.offsets[i]; j < data.offsets[i + 1]; j++) {
+    const x = xs[j], geneWidth = data.gene_lengths[j] * g.scale_factor;
+    if (x + geneWidth < left || x > right) continue;
+    const name = data.gene_names[j];
+    ctx.globalAlpha = searched && !geneMatches[j] ? 0.25 : 1;
+    ctx.fillStyle = data.colors[name];
+    ctx.fillRect(x, geneY, geneWidth, g.gene_height);
+    ctx.lineWidth = g.stroke_width;
+    ctx.strokeStyle = 'black';
+    ctx.strokeRect(x, geneY, geneWidth, g.gene_height);
+    // gene name, rotated and shrunk as in get_label when wider than the gene
+    const text = data.labels[name];
+    let fontSize = Math.floor(g.gene_height / 3), textSize = text.length * fontSize / 2;
+    const rotated = textSize >= geneWidth;
+    if (rotated && textSize > g.gene_height) {
+      fontSize = Math.floor(2 * g.gene_height / text.length);
+      textSize = text.length * fontSize / 2;
+    }
+    if (rotated) {
+      label(text, fontSize, x + (geneWidth + fontSize * 0.7) / 2, geneY + (g.gene_height + textSize) / 2, true);
+    } else {
+      label(text, fontSize, x + (geneWidth - textSize) / 2, geneY + (g.gene_height + fontSize * 0.75) / 2);
+    }
+    const strand = data.strands[j];
+    if (data.oriented && data.names[name] !== 'intergenic' && strand !== '.') {
+      orientation(strand, data.gene_lengths[j], x, geneY);
+    }
+  }
+  ctx.globalAlpha = 1;
+}
+
+function draw() {
+  ctx.save();
+  ctx.fillStyle = 'white';
+  ctx.fillRect(0, 0, width, height);
+  ctx.scale(view.scale, view.scale);
+  ctx.translate(-view.x, -view.y);
+  // only the ribbons and the genes in the viewport
+  const left = view.x, right = view.x + width / view.scale;
+  const first = Math.max(0, Math.floor(view.y / g.ribbon_height));
+  const last = Math.min(nbGenomes, Math.ceil((view.y + height / view.scale) / g.ribbon_height));
+  for (let i = first; i < last; i++) drawGenome(i, left, right);
+  ctx.restore();
+}
+
+function find(query) {
+  query = query.trim().toLowerCase();
+  matches = [];
+  current = -1;
+  if (!query) {
+    geneMatches = genomeMatches = null;
+    status.textContent = '';
+    return;
+  }
+  // a species matches with all its genes, a gene name alone
+  const names = data.names.map((name, k) => name.toLowerCase().includes(query) ||
+                                            data.labels[k].toLowerCase().includes(query));
+  geneMatches = new Uint8Array(nbGenes);
+  genomeMatches = new Uint8Array(nbGenomes);
+  let nbMatchingGenes = 0;
+  for (let i = 0; i < nbGenomes; i++) {
+    const species = data.species[i].toLowerCase().includes(query);
+    for (let j = data.offsets[i]; j < data.offsets[i + 1]; j++) {
+      if (species || names[data.gene_names[j]]) {
+        geneMatches[j] = genomeMatches[i] = 1;
+        nbMatchingGenes++;
+      }
+    }
+    if (genomeMatches[i]) matches.push(i);
+  }
+  status.textContent = matches.length + ' genomes, ' + nbMatchingGenes + ' genes';
+}
+
+function next() {
+  if (matches.length === 0) return;
+  current = (current + 1) % matches.length;
+  view.y = matches[current] * g.ribbon_height;
+  status.textContent = (current + 1) + ' / ' + matches.length + ' genomes';
+  redraw();
+}
+
+canvas.addEventListener('wheel', event => {
+  // zoom around the pointer
+  event.preventDefault();
+  const factor = Math.exp(-event.deltaY * 0.002);
+  const x = view.x + event.offsetX / view.scale, y = view.y + event.offsetY / view.scale;
+  view.scale *= factor;
+  view.x = x - event.offsetX / view.scale;
+  view.y = y - event.offsetY / view.scale;
+  redraw();
+}, {passive: false});
+let drag = null;
+canvas.addEventListener('mousedown', event => {
+  drag = {x: event.clientX, y: event.clientY};
+  canvas.style.cursor = 'grabbing';
+});
+window.addEventListener('mousemove', event => {
+  if (drag === null) return;
+  view.x -= (event.clientX - drag.x) / view.scale;
+  view.y -= (event.clientY - drag.y) / view.scale;
+  drag = {x: event.clientX, y: event.clientY};
+  redraw();
+});
+window.addEventListener('mouseup', () => { drag = null; canvas.style.cursor = 'grab'; });
+canvas.addEventListener('dblclick', fit);
+window.addEventListener('resize', () => { resize(); redraw(); });
+search.addEventListener('input', () => { find(search.value); redraw(); });
+search.addEventListener('keydown', event => { if (event.key === 'Enter') next(); });
+resize();
+fit();
+</script>
+</body>
+</html>
+'''
+
+
+def get_viewer_data(genomes: List[MtGenome], options: RenderOptions) -> dict:
+    # columnar genomes: one list per attribute of the genes, the genes of the i-th genome being those from
+    # offsets[i] to offsets[i + 1], and their names as indexes in a table of distinct names
+    color_scheme = COLOR_SCHEMES['monochromatic'] if options.monochromatic else COLOR_SCHEMES['default']
+    names, name_indexes = [], {}
+    offsets, gene_names, gene_lengths, strands = [0], [], [], []
+    for genome in genomes:
+        for gene in genome.genes:
+            if gene.name not in name_indexes:
+                name_indexes[gene.name] = len(names)
+                names.append(gene.name)
+            gene_names.append(name_indexes[gene.name])
+            gene_lengths.append(gene.scaled_length)
+            strands.append(gene.orientation if gene.orientation in ('+', '-') else '.')
+        offsets.append(len(gene_names))
+    return {'species': [genome.species for genome in genomes],
+            'lengths': [genome.length for genome in genomes],
+            'offsets': offsets,
+            'names': names,
+            'labels': [name if options.full_name else get_clean_name(name) for name in names],
+            'colors': [get_color(color_scheme, name) for name in names],
+            'strand_colors': {strand: get_color(color_scheme, strand) for strand in ('+', '-')},
+            'gene_names': gene_names,
+            'gene_lengths': gene_lengths,
+            'strands': ''.join(strands),
+            'oriented': options.oriented,
+            'font': options.font,
+            'geometry': {'scale_factor': SCALE_FACTOR, 'stroke_width': STROKE_WIDTH, 'gene_height': GENE_HEIGHT,
+                         'orientation_height': ORIENTATION_HEIGHT, 'intra_genome_space': INTRA_GENOME_SPACE,
+                         'species_height': SPECIES_HEIGHT, 'ribbon_height': RIBBON_HEIGHT}}
+
+
+def write_viewer(genomes: List[MtGenome], options: RenderOptions, output: Union[str, TextIO]):
+    # an html page drawing the ribbons of the genomes, whatever the level of detail and the circular option
+    if options.circular:
+        logging.warning('The html viewer draws ribbons, circular representation ignored')
+    data = json.dumps(get_viewer_data(genomes, options), separators=(',', ':')).replace('</', '<\\/')
+    with profile_stage('write', output if isinstance(output, str) else None) as stage:
+        with open_output(output) as f:
+            f.write(VIEWER_TEMPLATE.replace('__MIN_FONT_SIZE__', str(VIEWER_MIN_FONT_SIZE)).replace('__DATA__', data))
+    if stage is not None and isinstance(output, str):
+        stage.add(bytes=os.path.getsize(output))
+
+
+# ----------------------------- API -----------------------------#
+
+def read_genomes(gff: Union[str, TextIO], species: str = None, size: int = None, reversed: bool = False,
+                 skip: str = None) -> List[MtGenome]:
+    # gff is the text of a gff or a text stream, one genome per seqid unless the species and the size are given
+    source = StringIO(gff) if isinstance(gff, str) else gff
+    return load_genomes((species, size, source, reversed), get_skip_list(skip))
+
+
+def render_svg(genomes: Iterable[MtGenome], options: RenderOptions = None,
+               output: Union[str, TextIO, BinaryIO] = None) -> Optional[str]:
+    # the svg of genomes read by read_genomes or built from Gene objects, returned as a string unless written to
+    # output, a path, a text or a binary stream. The genomes given are left untouched
+    options = RenderOptions() if options is None else options
+    genomes = arrange_genomes(copy.deepcopy(list(genomes)), options.start, options.intergenic, options.linear)
+    if options.unique:
+        genomes = get_unique_arrangements(genomes, not options.linear)
+    if options.sort:
+        genomes = sort_by_similarity(genomes, not options.linear)
+    target = StringIO() if output is None else output
+    if isinstance(output, (RawIOBase, BufferedIOBase)):
+        target = TextIOWrapper(output, encoding='utf-8')
+    render_layout(get_layout(genomes, options), options, target)
+    if target is not output and output is not None:
+        # flush the text layer without closing the binary stream
+        target.flush()
+        target.detach()
+    return target.getvalue() if output is None else None
+
+
+def render_gff(gff: Union[str, TextIO], options: RenderOptions = None, output: Union[str, TextIO, BinaryIO] = None,
+               species: str = None, size: int = None, reversed: bool = False) -> Optional[str]:
+    # render_svg of the genomes of the text of a gff or of a text stream
+    options = RenderOptions() if options is None else options
+    return render_svg(read_genomes(gff, species, size, reversed, options.skip), options, output)
+
+
+# ----------------------------- BATCH -----------------------------#
+
+GFF_EXTENSIONS = ('.gff', '.gff3', '.gff.gz', '.gff3.gz', '.gff.bz2', '.gff3.bz2')
+ANNOTATION_EXTENSIONS = GFF_EXTENSIONS + GENBANK_EXTENSIONS
+BATCH_CHUNK_SIZE = 8  # genomes drawn by a worker per task
+BATCH_PENDING_CHUNKS = 4  # tasks waiting per worker, bounds the genomes held by the reading process
+
+
+@dataclass
+class BatchJob:
+    entry: Tuple[str, int, str, bool]
+    output_dir: str
+    options: RenderOptions
+    name: str = None
+
+
+@dataclass
+class BatchResult:
+    source: str
+    species: str
+    output: str
+    error: str = None
+    written: str = None  # temporary file moved to output, or to the next free name, by render_batch
+
+
+@dataclass
+class BatchTask:
+    job: BatchJob
+    genomes: List[MtGenome]
+    outputs: List[str]
+    written: List[str]
+
+
+def get_safe_name(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', name).strip('_') or 'genome'
+
+
+def get_source_entries(source: str) -> List[Tuple[str, int, str, bool]]:
+    # a config file in the --gffs format, a directory of gff or GenBank files, a single one or a glob pattern
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(source, f) for f in os.listdir(source) if f.lower().endswith(ANNOTATION_EXTENSIONS))
+        entries = [(None, None, path, False) for path in paths]
+    elif os.path.isfile(source) and source.lower().endswith(ANNOTATION_EXTENSIONS):
+        entries = [(None, None, source, False)]
+    elif os.path.isfile(source):
+        entries = parse_gffs(source)
+        if entries is None:
+            raise MtSVGError(f'wrong gffs file format: {source}')
+    else:
+        entries = [(None, None, path, False) for path in sorted(glob.glob(source))]
+    return entries
+
+
+def get_file_stem(filepath: str) -> str:
+    stem = os.path.basename(filepath)
+    for ext in ANNOTATION_EXTENSIONS:
+        if stem.lower().endswith(ext):
+            return stem[:-len(ext)]
+    return stem
+
+
+def get_batch_jobs(source: str, output_dir: str, options: RenderOptions) -> List[BatchJob]:
+    # each job is named after the species of its config entry or after its file
+    jobs = []
+    for entry in get_source_entries(source):
+        named = entry[0] is not None and entry[1] is not None
+        jobs.append(BatchJob(entry, output_dir, options, get_safe_name(entry[0]) if named else get_file_stem(entry[2])))
+    return jobs
+
+
+def get_record_output(job: BatchJob, genome: MtGenome, nb_records: int) -> str:
+    # the job name for a single genome, followed by the species otherwise
+    if nb_records == 1:
+        return os.path.join(job.output_dir, job.name + '.svg')
+    return os.path.join(job.output_dir, f'{job.name}_{get_safe_name(genome.species)}.svg')
+
+
+def iter_batch_tasks(jobs: List[BatchJob],
+                     options: RenderOptions) -> Iterator[Tuple[int, Union[BatchTask, BatchResult]]]:
+    # the records of each job are read in this process and drawn by the workers by chunks, so that the records of a
+    # single file are spread over the pool, an error ends the reading of a job but not the batch
+    to_skip, pid, nb_written = get_skip_list(options.skip), os.getpid(), 0
+    cache = None if options.cache is None else GenomeCache(options.cache, options.cache_size)
+    for i, job in enumerate(jobs):
+        task, error = BatchTask(job, [], [], []), None
+        try:
+            # the first two records tell if the file holds several
+            genomes = iter_genomes(job.entry, to_skip, cache)
+            head = list(islice(genomes, 2))
+            for genome in chain(head, genomes):
+                output = get_record_output(job, genome, len(head))
+                nb_written += 1
+                task.genomes.append(genome)
+                task.outputs.append(output)
+                task.written.append(os.path.join(job.output_dir, f'.{os.path.basename(output)}.{pid}.{nb_written}.tmp'))
+                if len(task.genomes) == BATCH_CHUNK_SIZE:
+                    yield i, task
+                    task = BatchTask(job, [], [], [])
+        except Exception as e:
+            error = BatchResult(job.entry[2], job.entry[0], None, f'{type(e).__name__}: {e}')
+        if task.genomes:
+            yield i, task
+        if error is not None:
+            yield i, error
+
+
+def render_batch_task(task: BatchTask) -> List[BatchResult]:
+    # errors are reported in the results so that a bad genome never stops the batch
+    options, source, results = task.job.options, task.job.entry[2], []
+    for genome, output, written in zip(task.genomes, task.outputs, task.written):
+        try:
+            arranged = arrange_genomes([genome], options.start, options.intergenic, options.linear)
+            render_layout(get_layout(arranged, options), options, written)
+            results.append(BatchResult(source, genome.species, output, written=written))
+        except Exception as e:
+            if os.path.exists(written):
+                os.remove(written)
+            results.append(BatchResult(source, genome.species, None, f'{type(e).__name__}: {e}'))
+    return results
+
+
+def claim_output(result: BatchResult, claimed: set) -> BatchResult:
+    # moves the file written by a worker to its output, suffixed by the next free _2, _3... when another genome of
+    # the batch already got this name
+    if result.written is None:
+        return result
+    base, extension = os.path.splitext(result.output)
+    output, i = result.output, 1
+    while output in claimed:
+        i += 1
+        output = f'{base}_{i}{extension}'
+    claimed.add(output)
+    os.replace(result.written, output)
+    return replace(result, output=output, written=None)
+
+
+def render_batch(source: str, output_dir: str, options: RenderOptions = None, workers: int = None,
+                 progress: bool = True) -> List[BatchResult]:
+    options = RenderOptions() if options is None else options
+    if options.synonyms is not None:
+        try:
+            load_synonyms(options.synonyms)
+        except OSError as e:
+            raise MtSVGError(f'cannot read synonyms: {e}')
+    os.makedirs(output_dir, exist_ok=True)
+    jobs, results, claimed, pending = get_batch_jobs(source, output_dir, options), [], set(), deque()
+    executor = None if workers == 1 else ProcessPoolExecutor(max_workers=workers)
+    max_pending = 1 if executor is None else BATCH_PENDING_CHUNKS * (workers or os.cpu_count() or 1)
+
+    def claim(i: int, task_results: Union[List[BatchResult], Future]):
+        # the tasks are claimed in the input order, so are the output names and the progress
+        for result in task_results.result() if isinstance(task_results, Future) else task_results:
+            result = claim_output(result, claimed)
+            if progress:
+                status = result.output if result.error is None else f'FAILED ({result.error})'
+                print(f'[{i + 1}/{len(jobs)}] {result.species or result.source} -> {status}', flush=True)
+            results.append(result)
+
+    try:
+        for i, item in iter_batch_tasks(jobs, options):
+            if isinstance(item, BatchResult):
+                pending.append((i, [item]))
+            elif executor is None:
+                pending.append((i, render_batch_task(item)))
+            else:
+                pending.append((i, executor.submit(render_batch_task, item)))
+            while len(pending) >= max_pending:
+                claim(*pending.popleft())
+        while pending:
+            claim(*pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return results
+
+
+# ----------------------------- TILES -----------------------------#
+
+@dataclass
+class TileJob:
+    genomes: List[MtGenome]
+    x: int
+    width: int
+    output: str
+    options: RenderOptions
+    detail: int = DETAIL_FULL
+
+
+def get_tile_jobs(genomes: List[MtGenome], output_dir: str, name: str, options: RenderOptions,
+                  rows: int = None, tile_width: int = None) -> Tuple[List[TileJob], dict]:
+    # pages of rows ribbons, cut in windows of tile_width drawing units, and the index describing them
+    width, height = get_drawing_size(max(get_ribbon_width(genome.get_scaled_length(), genome.get_nb_genes())
+                                         for genome in genomes), len(genomes))
+    rows = len(genomes) if rows is None else rows
+    tile_width = width if tile_width is None else tile_width
+    if rows < 1 or tile_width < 1:
+        raise MtSVGError('the tile rows and width must be positive')
+    drawables = [get_drawable(genome, i, options) for i, genome in enumerate(genomes)]
+    set_detail(drawables, options.max_elements)
+    stem, ext = os.path.splitext(name)
+    jobs, tiles = [], []
+    for row, first in enumerate(range(0, len(genomes), rows)):
+        page = genomes[first:first + rows]
+        for column, x in enumerate(range(0, width, tile_width)):
+            output = os.path.join(output_dir, f'{stem}_{row}_{column}{ext or ".svg"}')
+            jobs.append(TileJob(page, x, min(tile_width, width - x), output, options, drawables[0].detail))
+            tiles.append({'file': os.path.basename(output), 'row': row, 'column': column,
+                          'x': x, 'y': first * RIBBON_HEIGHT, 'width': jobs[-1].width,
+                          'height': len(page) * RIBBON_HEIGHT, 'species': [genome.species for genome in page]})
+    index = {'width': width, 'height': height, 'pixel_scale': PIXEL_SCALE, 'rows': rows, 'tile_width': tile_width,
+             'tiles': tiles}
+    return jobs, index
+
+
+def render_tile(job: TileJob) -> str:
+    # the genomes are drawn shifted by the x of the tile, only the genes within the tile are emitted
+    drawables = []
+    for i, genome in enumerate(job.genomes):
+        drawable = materialize(get_drawable(genome, i, job.options))
+        drawable.origin.x, drawable.detail = -job.x, job.detail
+        drawable.window = (-STROKE_WIDTH, job.width + STROKE_WIDTH)
+        drawables.append(drawable)
+    drawing = draw.Drawing(job.width, len(drawables) * RIBBON_HEIGHT)
+    if job.options.optimize:
+        drawing.append(get_optimized_defs(drawables[0].color_scheme, job.options.font))
+    target = drawing if job.options.precision is None else PrecisionDrawing(drawing, job.options.precision)
+    for drawable in drawables:
+        draw_genome(drawable, target)
     drawing.set_pixel_scale(PIXEL_SCALE)
-    drawing.save_svg(output)
+    write_drawing(drawing, job.output)
+    return job.output
+
+
+def render_tiles(genomes: List[MtGenome], output_dir: str, name: str, options: RenderOptions = None,
+                 rows: int = None, tile_width: int = None, workers: int = None, progress: bool = True) -> dict:
+    # one svg per tile plus an index, in json, of the position and of the genomes of each tile
+    options = RenderOptions() if options is None else options
+    if options.circular:
+        raise MtSVGError('tiles not supported with the circular representation')
+    os.makedirs(output_dir, exist_ok=True)
+    jobs, index = get_tile_jobs(genomes, output_dir, name, options, rows, tile_width)
+    if workers == 1:
+        outputs = map(render_tile, jobs)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        outputs = executor.map(render_tile, jobs)
+    try:
+        for i, output in enumerate(outputs):
+            if progress:
+                print(f'[{i + 1}/{len(jobs)}] {output}', flush=True)
+    finally:
+        if workers != 1:
+            executor.shutdown()
+    with open(os.path.join(output_dir, os.path.splitext(name)[0] + '.json'), 'wt', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+# ----------------------------- STREAMING -----------------------------#
+
+def get_svg_header(width: int, height: int, pixel_scale: float = PIXEL_SCALE) -> str:
+    # same header as draw.Drawing.as_svg, without the closing tag
+    empty = draw.Drawing(width, height)
+    empty.set_pixel_scale(pixel_scale)
+    return empty.as_svg()[:-len(SVG_END)]
+
+
+class StreamingDrawing:
+    # stands for a draw.Drawing whose elements are written to the output as soon as they are appended
+
+    def __init__(self, output_file: TextIO, width: int, height: int, pixel_scale: float = PIXEL_SCALE,
+                 header: bool = True):
+        self.width, self.height = width, height
+        self.output_file = output_file
+        self.context = draw.types.Context()
+        self.id_map = defaultdict(lambda: f'd{len(self.id_map)}')
+        if header:
+            output_file.write(get_svg_header(width, height, pixel_scale))
+
+    def append(self, element: draw.DrawingElement):
+        local = draw.types.LocalContext(self.context, element, self)
+        element.write_svg_element(self.id_map, lambda obj: False, self.output_file, local, False)
+        self.output_file.write('\n')
+
+    def close(self):
+        self.output_file.write(SVG_END)
+
+
+def stream_svg(species: List[Tuple[str, int, str, bool]], output: Union[str, TextIO], options: RenderOptions = None,
+               cache: GenomeCache = None):
+    # two passes over the gffs so that a single genome is held in memory at a time
+    options = RenderOptions() if options is None else options
+    if options.unique:
+        raise MtSVGError('unique arrangements not supported with --stream')
+    if options.sort:
+        raise MtSVGError('similarity ordering not supported with --stream')
+    to_skip = get_skip_list(options.skip)
+
+    # first pass: gene lengths only, for the scaling unit and the canvas size
+    all_lengths = []
+    for entry in species:
+        for genome in iter_genomes(entry, to_skip, cache):
+            if genome.get_nb_genes() == 0:
+                logging.warning(f'No gene found for {genome.species}, removed from the drawing')
+                continue
+            if options.intergenic > 0:
+                genome.add_intergenic(options.intergenic)
+            all_lengths.append(array('q', genome.get_lengths()))
+    if len(all_lengths) == 0:
+        raise MtSVGError('no gene found in any genome')
+    if options.circular and len(all_lengths) > 1:
+        raise MtSVGError('concentric circular representation not supported with --stream')
+    unit = get_unit(all_lengths)
+    width = max(get_ribbon_width(sum(max(1, ceil(length / unit)) for length in lengths), len(lengths))
+                for lengths in all_lengths)
+    width, height = get_drawing_size(width, len(all_lengths), options.circular)
+    del all_lengths
+
+    # with an element budget, an extra pass counts the elements of each level of detail
+    detail = DETAIL_FULL
+    if options.max_elements is not None:
+        nb_elements, i = [0] * len(DETAILS), 0
+        for entry in species:
+            for genome in iter_genomes(entry, to_skip, cache):
+                if genome.get_nb_genes() == 0:
+                    continue
+                genome = arrange_genomes([genome], options.start, options.intergenic, options.linear, unit)[0]
+                counts = count_detail_elements(get_drawable(genome, i, options), options.circular)
+                nb_elements = [total + count for total, count in zip(nb_elements, counts)]
+                i += 1
+        detail = get_detail(nb_elements, options.max_elements)
+
+    # second pass: arrange and write each genome before reading the next one
+    with open_output(output) as f:
+        drawing, i = StreamingDrawing(f, width, height), 0
+        target = drawing if options.precision is None else PrecisionDrawing(drawing, options.precision)
+        for entry in species:
+            for genome in iter_genomes(entry, to_skip, cache):
+                if genome.get_nb_genes() == 0:
+                    continue
+                genome = arrange_genomes([genome], options.start, options.intergenic, options.linear, unit)[0]
+                drawable = get_drawable(genome, i, options)
+                drawable.detail = detail
+                if i == 0 and options.optimize:
+                    drawing.append(get_optimized_defs(drawable.color_scheme, options.font))
+                if options.circular:
+                    draw_circular_genome(drawable, target)
+                else:
+                    draw_genome(drawable, target)
+                i += 1
+        drawing.close()
+
+
+# ----------------------------- SERVER -----------------------------#
+
+DEFAULT_SERVER_ADDRESS = '127.0.0.1:8765'
+DEFAULT_SERVER_CACHE = 1024  # entries
+SERVER_IGNORED_OPTIONS = ('cache', 'cache_size', 'synonyms')
+SERVER_MINIMUMS = {'intergenic': 0, 'precision': 0, 'max_elements': 1, 'size': 1}
+TYPE_NAMES = {str: 'a string', int: 'an integer', float: 'a number', bool: 'a boolean'}
+
+
+class LRUCache:
+    # thread safe mapping keeping the most recently used entries
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class MemoryGenomeCache:
+    # in-memory counterpart of GenomeCache, records are stored as tuples and rebuilt for each request
+
+    def __init__(self, max_entries: int = DEFAULT_SERVER_CACHE):
+        self.records = LRUCache(max_entries)
+
+    def load(self, filepath: Union[str, TextIO], to_skip: List[str]) -> List[MtGenome]:
+        key = get_source_key(filepath, to_skip)
+        records = None if key is None else self.records.get(key)
+        if records is not None:
+            return from_records(records)
+        genomes = list(read_gff(filepath, to_skip))
+        if key is not None:
+            self.records.put(key, to_records(genomes))
+        return genomes
+
+
+def render_fragment(drawable: DrawableGenome, width: int, height: int, circular: bool = False,
+                    precision: int = None) -> str:
+    # the elements of a single genome, without the svg header
+    with StringIO() as f:
+        drawing = StreamingDrawing(f, width, height, header=False)
+        target = drawing if precision is None else PrecisionDrawing(drawing, precision)
+        if circular:
+            draw_circular_genome(drawable, target)
+        else:
+            draw_genome(drawable, target)
+        return f.getvalue()
+
+
+def get_fragment_key(drawable: DrawableGenome, size: Tuple[int, int], circular: bool, precision: int = None) -> tuple:
+    # everything the elements of a genome depend on
+    genome = drawable.genome
+    return (drawable.origin.x, drawable.origin.y, drawable.font, drawable.full_name, drawable.oriented,
+            drawable.optimized, drawable.detail, drawable.min_font_size, precision, tuple(drawable.color_scheme.items()), circular,
+            size if circular else None, genome.species, genome.length,
+            tuple((gene.name, gene.orientation, gene.scaled_length) for gene in genome.genes))
+
+
+def check_param(name: str, value, kind: type, optional: bool = True):
+    # a json value of the type of the option, bools are not taken for numbers nor floats for integers
+    if value is None and optional:
+        return None
+    if kind is float and type(value) is int:
+        value = float(value)
+    if type(value) is not kind:
+        raise MtSVGError(f'{name} must be {TYPE_NAMES[kind]}')
+    if name in SERVER_MINIMUMS and value < SERVER_MINIMUMS[name]:
+        raise MtSVGError(f'{name} must be at least {SERVER_MINIMUMS[name]}')
+    if kind is float and not value > 0:
+        raise MtSVGError(f'{name} must be positive')
+    return value
+
+
+def get_server_options(params: dict) -> RenderOptions:
+    # the options of a request, checked up front so that a wrong value gets a clear error
+    return RenderOptions(**{f.name: check_param(f.name, params[f.name], f.type, f.default is None)
+                            for f in fields(RenderOptions)
+                            if f.name in params and f.name not in SERVER_IGNORED_OPTIONS})
+
+
+class Renderer:
+    # renders the requests of the server, reusing the parsed gffs and the svg fragments of the genomes
+
+    def __init__(self, max_entries: int = DEFAULT_SERVER_CACHE):
+        self.genome_cache = MemoryGenomeCache(max_entries)
+        self.fragments = LRUCache(max_entries)
+        self.lock = threading.Lock()
+        self.requests, self.errors, self.total_ms, self.max_ms = 0, 0, 0., 0.
+
+    def get_entries(self, params: dict) -> List[Tuple[str, int, Union[str, TextIO], bool]]:
+        # same parameters as the command line, gff_content holding the text of a gff
+        def get_entry(p: dict):
+            if not isinstance(p, dict):
+                raise MtSVGError('each genome must be a json object')
+            content, gff = check_param('gff_content', p.get('gff_content'), str), check_param('gff', p.get('gff'), str)
+            if content is None and gff is None:
+                raise MtSVGError('missing gff or gff_content')
+            species, size = check_param('species', p.get('species'), str), check_param('size', p.get('size'), int)
+            is_reversed = check_param('reversed', p.get('reversed', False), bool, optional=False)
+            return species, size, StringIO(content) if content is not None else gff, is_reversed
+        if params.get('gffs') is not None:
+            entries = parse_gffs(check_param('gffs', params['gffs'], str))
+            if entries is None:
+                raise MtSVGError('wrong gffs file format')
+            return entries
+        if params.get('genomes') is not None:
+            if not isinstance(params['genomes'], list):
+                raise MtSVGError('genomes must be a list')
+            return [get_entry(p) for p in params['genomes']]
+        return [get_entry(params)]
+
+    def render(self, params: dict) -> bytes:
+        return self.render_genomes(self.get_entries(params), get_server_options(params))[0].encode('utf-8')
+
+    def render_genomes(self, entries: List[Tuple[str, int, Union[str, TextIO], bool]],
+                       options: RenderOptions) -> Tuple[str, float, int]:
+        # the svg, the scaling unit and the number of genomes drawn rather than taken from the fragments
+        to_skip = get_skip_list(options.skip)
+        genomes = [genome for entry in entries for genome in iter_genomes(entry, to_skip, self.genome_cache)]
+        genomes = arrange_genomes(genomes, options.start, options.intergenic, options.linear)
+        unit = get_unit(genome.get_lengths() for genome in genomes)
+        if options.unique:
+            genomes = get_unique_arrangements(genomes, not options.linear)
+        if options.sort:
+            genomes = sort_by_similarity(genomes, not options.linear)
+        if options.circular and len(genomes) > 1:
+            # the rings depend on the longest genome, drawn as a whole
+            svg = StringIO()
+            render_layout(get_layout(genomes, options), options, svg)
+            return svg.getvalue(), unit, len(genomes)
+        drawables = [get_drawable(genome, i, options) for i, genome in enumerate(genomes)]
+        set_detail(drawables, options.max_elements, options.circular)
+        width = max(get_ribbon_width(genome.get_scaled_length(), genome.get_nb_genes()) for genome in genomes)
+        width, height = get_drawing_size(width, len(drawables), options.circular)
+        parts = [get_svg_header(width, height)]
+        if options.optimize:
+            parts.append(get_optimized_defs(drawables[0].color_scheme, options.font).content + '\n')
+        nb_drawn = 0
+        for drawable in drawables:
+            key = get_fragment_key(drawable, (width, height), options.circular, options.precision)
+            fragment = self.fragments.get(key)
+            if fragment is None:
+                fragment = render_fragment(drawable, width, height, options.circular, options.precision)
+                self.fragments.put(key, fragment)
+                nb_drawn += 1
+            parts.append(fragment)
+        parts.append(SVG_END)
+        return ''.join(parts), unit, nb_drawn
+
+    def record(self, elapsed_ms: float, failed: bool):
+        with self.lock:
+            self.requests += 1
+            self.errors += failed
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = {'requests': self.requests, 'errors': self.errors,
+                     'mean_ms': self.total_ms / self.requests if self.requests else 0., 'max_ms': self.max_ms}
+        stats['genome_cache'] = self.genome_cache.records.get_stats()
+        stats['fragment_cache'] = self.fragments.get_stats()
+        return stats
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    # POST /render with the parameters as a JSON object returns the SVG, GET /stats returns the counters
+
+    def send(self, code: int, content_type: str, body: bytes):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send(200, 'application/json', json.dumps(self.server.renderer.get_stats()).encode())
+        else:
+            self.send(404, 'text/plain', b'Not found')
+
+    def do_POST(self):
+        if self.path != '/render':
+            self.send(404, 'text/plain', b'Not found')
+            return
+        start_time, renderer = time.perf_counter(), self.server.renderer
+        try:
+            params = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(params, dict):
+                raise MtSVGError('the parameters must be a json object')
+            svg = renderer.render(params)
+        except (MtSVGError, OSError, ValueError, TypeError, KeyError) as e:
+            renderer.record((time.perf_counter() - start_time) * 1000, True)
+            self.send(400, 'text/plain', f'Error : {e}'.encode())
+            return
+        except Exception as e:
+            # whatever fails, the client gets a reply and the failure is counted
+            logging.exception('Cannot render the request')
+            renderer.record((time.perf_counter() - start_time) * 1000, True)
+            self.send(500, 'text/plain', f'Error : {e}'.encode())
+            return
+        renderer.record((time.perf_counter() - start_time) * 1000, False)
+        self.send(200, 'image/svg+xml', svg)
+
+    def log_message(self, format: str, *args):
+        logging.debug(format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def is_socket(path: str) -> bool:
+    try:
+        return S_ISSOCK(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return host == 'localhost' or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def serve(address: str = DEFAULT_SERVER_ADDRESS, max_entries: int = DEFAULT_SERVER_CACHE):
+    # address is host:port for localhost HTTP or the path of a unix socket
+    host, sep, port = address.rpartition(':')
+    unix = not (sep and port.isdigit())
+    if not unix:
+        # the clients name files of this machine, which must not be read for anyone on the network
+        if not is_loopback(host or '127.0.0.1'):
+            raise MtSVGError(f'the server reads the files named in the requests, it only listens on a loopback '
+                             f'address or a unix socket, not {host}')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), RenderRequestHandler)
+    else:
+        # only a socket left by a previous server is replaced, never another file
+        if os.path.exists(address):
+            if not is_socket(address):
+                raise MtSVGError(f'{address} exists and is not a unix socket')
+            os.remove(address)
+        server = ThreadingUnixHTTPServer(address, RenderRequestHandler)
+    server.renderer = Renderer(max_entries)
+    print(f'Serving on {address}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix and is_socket(address):
+            os.remove(address)
+
+
+# ----------------------------- WATCH -----------------------------#
+
+DEFAULT_WATCH_INTERVAL = 1.0  # seconds
+
+
+def get_file_states(paths: Iterable[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+    # modification time and size of each path, None for a missing file
+    states = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            states[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            states[path] = None
+    return states
+
+
+def write_output(output: str, svg: str):
+    # written next to the output then renamed, so that a viewer never reads a partial figure
+    directory, name = os.path.split(output)
+    tmp_path = os.path.join(directory, f'.{os.getpid()}.{name}')
+    try:
+        with open_output(tmp_path) as f:
+            f.write(svg)
+        os.replace(tmp_path, output)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def watch(gffs: Union[str, List[Tuple[str, int, str, bool]]], output: str, options: RenderOptions = None,
+          interval: float = DEFAULT_WATCH_INTERVAL, renderer: 'Renderer' = None):
+    # gffs is the path of a config file, read again when it changes, or a list of entries
+    if output == '-' or output.lower().endswith(('.json', '.html')):
+        raise MtSVGError(f'--watch updates an svg file, it cannot write {output}')
+    options = RenderOptions() if options is None else options
+    renderer = Renderer() if renderer is None else renderer
+    states, unit = None, None
+    while True:
+        if isinstance(gffs, str):
+            entries = parse_gffs(gffs) or []
+            paths = [gffs] + [entry[2] for entry in entries]
+        else:
+            entries, paths = gffs, [entry[2] for entry in gffs]
+        new_states = get_file_states(paths)
+        if new_states != states:
+            states = new_states
+            try:
+                if not entries:
+                    raise MtSVGError('wrong gffs file format')
+                # only the modified gffs are parsed again and the unchanged ribbons reuse their fragments,
+                # unless the scaling unit moves and every ribbon is drawn again
+                svg, new_unit, nb_drawn = renderer.render_genomes(entries, options)
+                write_output(output, svg)
+                if unit is not None and new_unit != unit:
+                    logging.warning('The longest gene changed, every genome was scaled again')
+                unit = new_unit
+                print(f'{time.strftime("%H:%M:%S")} {output} updated, {nb_drawn} genome(s) drawn', flush=True)
+            except (MtSVGError, OSError) as e:
+                print(f'{time.strftime("%H:%M:%S")} Error : {e}', flush=True)
+            except Exception as e:
+                # a gff saved half way must not end the watch
+                print(f'{time.strftime("%H:%M:%S")} Error : {type(e).__name__}: {e}', flush=True)
+        time.sleep(interval)
 
 
 # ----------------------------- MAIN -----------------------------#
 
+def save_profile(profiler: Optional[Profiler], report: str = None, stats: str = None):
+    if profiler is None:
+        return
+    profiler.stop()
+    if report is not None:
+        profiler.save(report)
+    if stats is not None:
+        profiler.dump_stats(stats)
+
+
+DEFAULT_OUTPUT = 'mtDNA.svg'
+# style of an output -> options it overrides
+OUTPUT_STYLES = {'color': {'monochromatic': False}, 'monochromatic': {'monochromatic': True},
+                 'ribbon': {'circular': False}, 'circular': {'circular': True},
+                 'clean_name': {'full_name': False}, 'full_name': {'full_name': True},
+                 'unoriented': {'oriented': False}, 'oriented': {'oriented': True},
+                 'optimize': {'optimize': True}}
+
+
+def parse_output(output: str) -> Tuple[dict, str]:
+    # STYLE:PATH, STYLE being + separated OUTPUT_STYLES, otherwise a path, even with a colon
+    style, colon, path = output.partition(':')
+    if not colon or not path or any(name not in OUTPUT_STYLES for name in style.split('+')):
+        return {}, output
+    overrides = {}
+    for name in style.split('+'):
+        overrides.update(OUTPUT_STYLES[name])
+    return overrides, path
+
+
 def parse_gffs(filepath: str) -> List[Tuple[str, int, str, bool]]:
     try:
         results = []
-        with open(filepath, 'rt') as f:
+        with nullcontext(sys.stdin) if filepath == '-' else open(filepath, 'rt') as f:
             for line in f:
                 lstrip = line.strip()
                 if lstrip.startswith('#'):
@@ -495,7 +3043,8 @@ def parse_gffs(filepath: str) -> List[Tuple[str, int, str, bool]]:
                 lsplt = lstrip.split(';')
                 if len(lsplt) < 4:
                     continue
-                results.append((lsplt[0], int(lsplt[1]), lsplt[2], bool(lsplt[3])))
+                # empty species or size are read from the gff records
+                results.append((lsplt[0] or None, int(lsplt[1]) if lsplt[1] else None, lsplt[2], bool(lsplt[3])))
         return results
     except:
         return None
@@ -503,16 +3052,23 @@ def parse_gffs(filepath: str) -> List[Tuple[str, int, str, bool]]:
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Convert a mtDNA GFF to a linear SVG representation')
-    parser.add_argument('--gff', type=str, help='The path of a single gff file')
-    parser.add_argument('--species', type=str, help='The species name (ignored if --gffs is used)')
-    parser.add_argument('--size', type=int, help='The size of the mtDNA in base pair (ignored if --gffs is used)')
+    parser.add_argument('--gff', type=str,
+                        help='The path of a single gff file or GenBank flatfile, possibly gzip or bz2 compressed, - '
+                             'for stdin. Without --species and --size, each seqid or GenBank record of the file is '
+                             'drawn as a separate genome')
+    parser.add_argument('--species', type=str,
+                        help='The species name (ignored if --gffs is used, taken from the gff if omitted)')
+    parser.add_argument('--size', type=int,
+                        help='The size of the mtDNA in base pair (ignored if --gffs is used, taken from the gff '
+                             '##sequence-region or region line if omitted)')
     parser.add_argument('--reversed', action='store_true', help='Reverse the gene order (ignored if --gffs is used')
     parser.add_argument('--gffs', type=str,
                         help='The path of the semicolon separated config file to draw multiple ribbons. Each entry in '
                              'the config file must have the following format: "species;mtdna size;gff path;reverse '
                              'gene order" like for instance "Halocynthia roretzi;14771;example/h_roretzi.gff;false". '
                              'Comments can be inserted using "#" to start a line and the last "true/false" value for '
-                             'the gene order can be omitted when using false.')
+                             'the gene order can be omitted when using false. Leaving the species and size empty '
+                             'draws every seqid of the gff as a separate genome. - reads the config file from stdin.')
     parser.add_argument('--start', type=str, help='Start gene of the ribbon', default='cox1')
     parser.add_argument('--linear', action='store_true',
                         help='Show the genes in the same order as in the gff file.')
@@ -521,30 +3077,210 @@ if __name__ == '__main__':
     parser.add_argument('--oriented', action='store_true', help='Display gene orientations')
     parser.add_argument('--full_name', action='store_true', help='Display gene full names')
     parser.add_argument('--monochromatic', action='store_true', help='Do not colorize')
-    parser.add_argument('--circular', action='store_true', help='Draw a circular representation (for single gff only)')
+    parser.add_argument('--circular', action='store_true', help='Draw a circular representation, one ring per genome')
     parser.add_argument('--font', type=str, help='The font to use', default='Arial')
-    parser.add_argument('--output', type=str, help='The path of the output to create', default='mtDNA.svg')
+    parser.add_argument('--output', type=str, action='append',
+                        help=f'The path of the output to create (default: {DEFAULT_OUTPUT}), gzip compressed if '
+                             f'ending with .svgz, - for stdout. Repeat it to render the genomes parsed once to several '
+                             f'outputs, written as STYLE:PATH to override the options of an output with + separated '
+                             f'styles among {", ".join(OUTPUT_STYLES)}. Paths ending with .json get the layout of '
+                             f'the figure, the coordinates of its shapes, and paths ending with .html an interactive '
+                             f'viewer for thousands of genomes')
+    parser.add_argument('--optimize', action='store_true',
+                        help='Smaller SVG using css classes for the colors and fonts and shared arrow definitions')
+    parser.add_argument('--precision', type=int, help='The number of decimals of the coordinates')
+    parser.add_argument('--max_elements', type=int,
+                        help='Lower the level of detail until the figure has at most MAX_ELEMENTS elements: first drop '
+                             'the rotated or shrunk gene names, then draw one orientation per run of genes on the same '
+                             'strand and finally one block per run of genes of the same class')
+    parser.add_argument('--zoom', type=float,
+                        help='The zoom the figure is meant to be displayed at, gene names too small to be read at '
+                             'this zoom are not drawn')
+    parser.add_argument('--unique', action='store_true',
+                        help='Draw each gene order once, labeled with the species sharing it. The orders are compared '
+                             'whatever the strand and, unless --linear, the first gene')
+    parser.add_argument('--sort', action='store_true',
+                        help='Draw the genomes with similar gene orders next to each other instead of in the config '
+                             'order')
     parser.add_argument('--skip', type=str, help='Comma separated list of gene names to skip')
+    parser.add_argument('--synonyms', type=str,
+                        help='The path of a semicolon separated file of "synonym;gene name" lines used to rename '
+                             'non-standard gene names or products, for instance "COI;cox1"')
+    parser.add_argument('--batch', type=str,
+                        help='Render each genome in its own SVG. BATCH is a config file in the --gffs format, a '
+                             'directory of gff or GenBank files or a quoted glob pattern')
+    parser.add_argument('--output_dir', type=str, default='.',
+                        help='The directory of the SVGs created by --batch or of the tiles')
+    parser.add_argument('--workers', type=int,
+                        help='The number of processes used by --batch or to draw the tiles (default: all CPUs)')
+    parser.add_argument('--jobs', type=int,
+                        help='The number of threads reading the distinct gffs of a config file concurrently '
+                             '(default: min(32, CPUs + 4)), 1 to read them one after the other, as --profile does')
+    parser.add_argument('--cache', type=str, nargs='?', const=DEFAULT_CACHE_DIR,
+                        help=f'Reuse the parsed gffs stored in the CACHE directory (default: {DEFAULT_CACHE_DIR}) '
+                             f'while their path, modification time, size and --skip list are unchanged')
+    parser.add_argument('--cache_size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help='The maximum size of the cache in MB, least recently used entries are evicted first')
+    parser.add_argument('--clear_cache', action='store_true', help='Empty the cache directory')
+    parser.add_argument('--compact', action='store_true',
+                        help='Store the genes in compact arrays instead of one object per gene, each genome being '
+                             'materialized only for its layout. This lowers the memory held between the parsing and '
+                             'the drawing, not the peak of the drawing, which --stream bounds')
+    parser.add_argument('--catalog', type=str,
+                        help='The path of a SQLite catalog of genomes, filled by --import. Without --import, the '
+                             'genomes of the catalog matching --query are drawn instead of those of the gffs')
+    parser.add_argument('--import', type=str, dest='import_source', metavar='IMPORT',
+                        help='Add to the --catalog the genomes of IMPORT, a config file in the --gffs format, a '
+                             'directory of gff or GenBank files or a quoted glob pattern, replacing those previously '
+                             'imported from the same files')
+    parser.add_argument('--query', type=str,
+                        help='Space separated terms that the genomes of the --catalog to draw all match: a gene name '
+                             '(atp8), a gene name and a strand (nad6-), a gene followed by another one (cox1>cox2), '
+                             'species:TEXT for the species names containing TEXT or order:SPECIES for the gene order '
+                             'of SPECIES. ! before a term negates it (!atp8)')
+    parser.add_argument('--serve', type=str, nargs='?', const=DEFAULT_SERVER_ADDRESS,
+                        help=f'Run a render server on SERVE, host:port of a loopback address (default: '
+                             f'{DEFAULT_SERVER_ADDRESS}) or the path of a unix socket, as the requests name files of '
+                             f'this machine. POST /render takes the parameters of the command line as a JSON object, '
+                             f'with gff_content for the text of a gff, and GET /stats returns the counters')
+    parser.add_argument('--server_cache', type=int, default=DEFAULT_SERVER_CACHE,
+                        help='The number of parsed gffs and of genome fragments kept in memory by --serve or --watch')
+    parser.add_argument('--tile_rows', type=int,
+                        help='Split the figure into pages of TILE_ROWS ribbons, each one written in --output_dir as '
+                             'its own SVG named after --output, with a json index of the tiles')
+    parser.add_argument('--tile_width', type=int,
+                        help='Also split the pages into windows of TILE_WIDTH drawing units, only the genes within a '
+                             'window are drawn in its tile')
+    parser.add_argument('--watch', type=float, nargs='?', const=DEFAULT_WATCH_INTERVAL,
+                        help=f'Keep running and update the output each time the gffs or the config file change, '
+                             f'checked every WATCH seconds (default: {DEFAULT_WATCH_INTERVAL}). Only the modified gffs '
+                             f'are parsed again and only the genomes whose drawing changed are drawn again')
+    parser.add_argument('--stream', action='store_true',
+                        help='Write each genome to the output as soon as it is drawn, the gffs are read twice but a '
+                             'single genome is held in memory at a time')
+    parser.add_argument('--profile', type=str, nargs='?', const='mtSVG_profile.json',
+                        help='Write to PROFILE (default: mtSVG_profile.json) a json report of the wall time and '
+                             'allocations of each stage and genome, with the number of elements drawn and of bytes '
+                             'written')
+    parser.add_argument('--cprofile', type=str, help='Write the cProfile statistics of the run to CPROFILE')
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
 
-    if args.gff is not None:
-        if args.species is None:
-            sys.exit('Error : missing species')
-        if args.size is None:
-            sys.exit('Error : missing size')
-        gffs = [(args.species, args.size, args.gff, args.reversed)]
+    if args.clear_cache:
+        GenomeCache(args.cache or DEFAULT_CACHE_DIR).clear()
+        if args.gff is None and args.gffs is None and args.batch is None and args.catalog is None:
+            print('Done !')
+            sys.exit()
+
+    if args.synonyms is not None:
+        try:
+            load_synonyms(args.synonyms)
+        except OSError as e:
+            sys.exit(f'Error : cannot read synonyms: {e}')
+
+    if args.serve is not None:
+        try:
+            serve(args.serve, args.server_cache)
+        except MtSVGError as e:
+            sys.exit(f'Error : {e}')
+        sys.exit()
+
+    if args.batch is not None:
+        try:
+            results = render_batch(args.batch, args.output_dir, RenderOptions.from_args(args), args.workers)
+        except MtSVGError as e:
+            sys.exit(f'Error : {e}')
+        failed = sum(1 for result in results if result.error is not None)
+        if failed > 0:
+            sys.exit(f'Error : {failed} of {len(results)} genomes failed')
+        print('Done !')
+        sys.exit()
+
+    profiler = None
+    if args.profile is not None or args.cprofile is not None:
+        profiler = Profiler(trace_memory=args.profile is not None, cprofile=args.cprofile is not None)
+        profiler.start()
+
+    if (args.import_source is not None or args.query is not None) and args.catalog is None:
+        sys.exit('Error : --import and --query need a --catalog')
+    if args.import_source is not None:
+        try:
+            nb_genomes = import_catalog(args.catalog, get_source_entries(args.import_source), args.jobs)
+        except (MtSVGError, OSError) as e:
+            sys.exit(f'Error : {e}')
+        save_profile(profiler, args.profile, args.cprofile)
+        print(f'{nb_genomes} genome(s) imported in {args.catalog}')
+        print('Done !')
+        sys.exit()
+
+    # - reads the gff or the config file from stdin and writes the svg to stdout
+    outputs = [parse_output(output) for output in args.output or [DEFAULT_OUTPUT]]
+    output = sys.stdout if outputs[0][1] == '-' else outputs[0][1]
+    done_file = sys.stderr if any(path == '-' for _, path in outputs) else sys.stdout
+    tiled = args.tile_rows is not None or args.tile_width is not None
+    if len(outputs) > 1 and (args.watch is not None or args.stream or tiled):
+        sys.exit('Error : a single --output is supported by --watch, --stream and the tiles')
+    options = replace(RenderOptions.from_args(args), **outputs[0][0])
+    if args.catalog is not None:
+        # the genomes are read from the catalog
+        gffs = None
+    elif args.gff is not None:
+        gffs = [(args.species, args.size, sys.stdin if args.gff == '-' else args.gff, args.reversed)]
     elif args.gffs is not None:
-        gffs = parse_gffs(args.gffs)
+        with profile_stage('parse_gffs', args.gffs):
+            gffs = parse_gffs(args.gffs)
         if gffs is None:
             sys.exit('Error : wrong gffs file format')
-        elif args.circular:
-            sys.exit('Error : circular representation not supported with multiple genomes')
     else:
         sys.exit('Error : missing gff(s) file')
 
-    genomes = get_genomes(gffs, args.start, args.intergenic, args.linear, args.skip)
-    if args.circular:
-        draw_circle(genomes, args.output, args.monochromatic, args.font, args.full_name, args.oriented)
+    if args.watch is not None:
+        if '-' in (args.gff, args.gffs):
+            sys.exit('Error : stdin cannot be watched')
+        if gffs is None:
+            sys.exit('Error : a catalog cannot be watched')
+        try:
+            watch(args.gffs or gffs, outputs[0][1], options, args.watch, Renderer(args.server_cache))
+        except MtSVGError as e:
+            sys.exit(f'Error : {e}')
+        except KeyboardInterrupt:
+            pass
+        sys.exit()
+
+    try:
+        cache = None if args.cache is None else GenomeCache(args.cache, args.cache_size)
+        if args.stream:
+            if tiled:
+                raise MtSVGError('tiles not supported with --stream')
+            if args.gff == '-':
+                raise MtSVGError('--stream reads the gffs twice, they cannot be read from stdin')
+            if gffs is None:
+                raise MtSVGError('catalog not supported with --stream')
+            stream_svg(gffs, output, options, cache)
+            save_profile(profiler, args.profile, args.cprofile)
+            print('Done !', file=done_file)
+            sys.exit()
+        if gffs is None:
+            genomes = get_catalog_genomes(args.catalog, args.query, args.start, args.intergenic, args.linear,
+                                          args.skip, args.compact)
+        else:
+            genomes = get_genomes(gffs, args.start, args.intergenic, args.linear, args.skip, cache, args.compact,
+                                  args.jobs)
+        if args.unique:
+            genomes = get_unique_arrangements(genomes, not args.linear)
+        if args.sort:
+            genomes = sort_by_similarity(genomes, not args.linear)
+    except MtSVGError as e:
+        sys.exit(f'Error : {e}')
+    if tiled:
+        try:
+            render_tiles(genomes, args.output_dir, os.path.basename(outputs[0][1]), options,
+                         args.tile_rows, args.tile_width, args.workers)
+        except MtSVGError as e:
+            sys.exit(f'Error : {e}')
     else:
-        draw_ribbons(genomes, args.output, args.monochromatic, args.font, args.full_name, args.oriented)
-    print('Done !')
+        # a single layout for the outputs differing only by their colors, font or css classes
+        options = RenderOptions.from_args(args)
+        render_figures(genomes, [(replace(options, **overrides), sys.stdout if path == '-' else path)
+                                 for overrides, path in outputs])
+    save_profile(profiler, args.profile, args.cprofile)
+    print('Done !', file=done_file)